@@ -0,0 +1,221 @@
+import functools
+import logging
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Dict
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек, миллисекунд
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+# Счётчик запросов к БД текущего вызова метода DB_M (см. timed)
+_call_queries: ContextVar[list[int] | None] = ContextVar(
+    "db_call_queries", default=None
+)
+
+
+class LatencyHistogram:
+    """Гистограмма задержек с фиксированными корзинами (мс)."""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS_MS) -> None:
+        self.buckets = buckets
+        # Последняя корзина — всё, что больше buckets[-1]
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, value_ms: float) -> None:
+        self.counts[bisect_left(self.buckets, value_ms)] += 1
+        self.count += 1
+        self.total_ms += value_ms
+        if value_ms > self.max_ms:
+            self.max_ms = value_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"<={b}" for b in self.buckets] + [f">{self.buckets[-1]}"]
+        return {
+            "count": self.count,
+            "avg_ms": self.total_ms / self.count if self.count else 0.0,
+            "max_ms": self.max_ms,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """
+    Пул соединений, замеряющий время получения соединения (checkout):
+    ожидание свободного соединения в пуле, открытие нового и pre_ping.
+    """
+
+    checkout_wait: LatencyHistogram | None = None
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            if self.checkout_wait is not None:
+                self.checkout_wait.observe((time.perf_counter() - started) * 1000)
+
+    def recreate(self):
+        # engine.dispose() пересоздаёт пул — переносим гистограмму
+        pool = super().recreate()
+        pool.checkout_wait = self.checkout_wait
+        return pool
+
+
+class DBMetrics:
+    """
+    Метрики слоя БД: состояние пулов соединений, время checkout,
+    задержки запросов к БД, задержки методов DB_M (только вызовов,
+    дошедших до БД) и медленные запросы.
+    """
+
+    def __init__(self, slow_query_ms: float = 200) -> None:
+        """
+        :param slow_query_ms: Порог медленного запроса, миллисекунд
+                              (запросы дольше логируются, 0 — не логировать).
+        """
+        self.slow_query_ms = slow_query_ms
+        self.methods: Dict[str, LatencyHistogram] = {}
+        # Вызовы методов без запросов к БД (кэш, write-behind буфер)
+        self.methods_without_queries: Dict[str, int] = {}
+        self.query_latency = LatencyHistogram()
+        self.queries = 0
+        self.slow_queries = 0
+        self._engines: Dict[str, AsyncEngine] = {}
+        self._checkout_wait: Dict[str, LatencyHistogram] = {}
+        self._peak_checked_out: Dict[str, int] = {}
+
+    def observe_method(self, name: str, value_ms: float) -> None:
+        histogram = self.methods.get(name)
+        if histogram is None:
+            histogram = self.methods[name] = LatencyHistogram()
+        histogram.observe(value_ms)
+
+    def observe_method_without_queries(self, name: str) -> None:
+        self.methods_without_queries[name] = (
+            self.methods_without_queries.get(name, 0) + 1
+        )
+
+    def instrument_engine(self, label: str, engine: AsyncEngine) -> None:
+        """Подписаться на события движка и его пула соединений."""
+        sync_engine = engine.sync_engine
+        self._engines[label] = engine
+        self._peak_checked_out[label] = 0
+
+        checkout_wait = self._checkout_wait[label] = LatencyHistogram()
+        if isinstance(sync_engine.pool, InstrumentedAsyncQueuePool):
+            sync_engine.pool.checkout_wait = checkout_wait
+
+        @event.listens_for(sync_engine, "checkout")
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            checked_out = getattr(sync_engine.pool, "checkedout", None)
+            if checked_out is not None:
+                self._peak_checked_out[label] = max(
+                    self._peak_checked_out[label], checked_out()
+                )
+
+        @event.listens_for(sync_engine, "before_cursor_execute")
+        def before_cursor_execute(
+            conn, cursor, statement, parameters, context, executemany
+        ):
+            # Время начала храним в контексте выполнения: он живёт один
+            # запрос, и упавший запрос ничего не оставляет в соединении
+            if context is not None:
+                context._query_started = time.perf_counter()
+            counter = _call_queries.get()
+            if counter is not None:
+                counter[0] += 1
+
+        @event.listens_for(sync_engine, "after_cursor_execute")
+        def after_cursor_execute(
+            conn, cursor, statement, parameters, context, executemany
+        ):
+            started = getattr(context, "_query_started", None)
+            if started is None:
+                return
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.queries += 1
+            self.query_latency.observe(elapsed_ms)
+            if self.slow_query_ms and elapsed_ms > self.slow_query_ms:
+                self.slow_queries += 1
+                logger.warning(
+                    f"Медленный запрос к БД ({label}) {elapsed_ms:.0f} мс: "
+                    f"{statement[:500]}"
+                )
+
+    def _pool_snapshot(self, label: str) -> Dict[str, Any]:
+        pool = self._engines[label].sync_engine.pool
+        snapshot: Dict[str, Any] = {"class": type(pool).__name__}
+        # У StaticPool/NullPool нет счётчиков QueuePool
+        if isinstance(pool, AsyncAdaptedQueuePool):
+            snapshot.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                overflow=max(pool.overflow(), 0),
+                max_overflow=pool._max_overflow,
+            )
+        snapshot["peak_checked_out"] = self._peak_checked_out[label]
+        snapshot["checkout_wait_ms"] = self._checkout_wait[label].snapshot()
+        return snapshot
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Текущие значения всех метрик."""
+        return {
+            "pools": {label: self._pool_snapshot(label) for label in self._engines},
+            "queries": {
+                "total": self.queries,
+                "slow": self.slow_queries,
+                "slow_threshold_ms": self.slow_query_ms,
+                "latency_ms": self.query_latency.snapshot(),
+            },
+            "methods": {
+                name: histogram.snapshot()
+                for name, histogram in sorted(self.methods.items())
+            },
+            "methods_without_queries": dict(
+                sorted(self.methods_without_queries.items())
+            ),
+        }
+
+
+def timed(method):
+    """
+    Декоратор корутин-методов DB_M: пишет задержку вызова в гистограмму
+    self.metrics под именем метода. Вызовы без запросов к БД (попадание
+    в кэш) только считаются, иначе они занижали бы перцентили.
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        outer = _call_queries.get()
+        counter = [0]
+        token = _call_queries.set(counter)
+        started = time.perf_counter()
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            _call_queries.reset(token)
+            if outer is not None:
+                # Запросы вложенного метода DB_M — и запросы внешнего
+                outer[0] += counter[0]
+            if counter[0]:
+                self.metrics.observe_method(name, elapsed_ms)
+            else:
+                self.metrics.observe_method_without_queries(name)
+
+    return wrapper
+
+
+__all__ = ["DBMetrics", "InstrumentedAsyncQueuePool", "LatencyHistogram", "timed"]
@@ -1,40 +1,50 @@
 from aiogram.filters import Filter
 from aiogram.types import Message
-from loader import db_manage
 from locales import get_text as _
+from storage import UserRecord
+
+
+def _status_user(user_record: UserRecord | None) -> str:
+    # Запись пользователя загружает MyLocalesMiddleware (data["user_record"]).
+    # Если пользователя ещё нет в БД — статус по умолчанию 'user'
+    return user_record.status_user if user_record else "user"
 
 
 class IsMainAdmin(Filter):
     def __init__(self) -> None:
         pass
 
-    async def __call__(self, message: Message) -> bool:
-        status_user = await db_manage.get_status_user(message.from_user.id)
-
-        return status_user[0] == "main_admin"
+    async def __call__(
+        self, message: Message, user_record: UserRecord | None = None
+    ) -> bool:
+        return _status_user(user_record) == "main_admin"
 
 
 class IsAdmin(Filter):
     def __init__(self) -> None:
         pass
 
-    async def __call__(self, message: Message) -> bool:
-        status_user = await db_manage.get_status_user(message.from_user.id)
+    async def __call__(
+        self, message: Message, user_record: UserRecord | None = None
+    ) -> bool:
+        status_user = _status_user(user_record)
 
-        return status_user[0] == "admin" or status_user[0] == "main_admin"
+        return status_user == "admin" or status_user == "main_admin"
 
 
 class IsUser(Filter):
     def __init__(self) -> None:
         pass
 
-    async def __call__(self, message: Message) -> bool:
-        status_user = await db_manage.get_status_user(message.from_user.id)
+    async def __call__(
+        self, message: Message, user_record: UserRecord | None = None
+    ) -> bool:
+        status_user = _status_user(user_record)
 
         return (
-            status_user[0] == "user"
-            or status_user[0] == "admin"
-            or status_user[0] == "main_admin"
+            status_user == "user"
+            or status_user == "admin"
+            or status_user == "main_admin"
         )
 
 
@@ -1,5 +1,8 @@
+from .db_stats import dp
 from .deep_link_manage import bot, dp
 from .def_file_id import bot, detect_file_id, dp
 from .notice import bot, dp
+from .panel_stats import dp
 from .pre_checkout_pay import dp
 from .role_manage import bot, dp
+from .stats_report import dp
@@ -0,0 +1,16 @@
+from aiogram import filters
+from aiogram.types import Message
+from filters import IsMainAdmin
+from loader import db_manage, dp
+
+from ..common import answer_json_stats
+
+
+####МЕТРИКИ БД: ПУЛ СОЕДИНЕНИЙ, ЗАДЕРЖКИ МЕТОДОВ, КЭШ####
+#########################################################
+@dp.message(filters.Command("db_stats"), IsMainAdmin())
+async def db_stats(message: Message):
+    await answer_json_stats(message, db_manage.db_stats())
+
+
+#########################################################
@@ -1,18 +1,48 @@
+import csv
+import io
+
 from aiogram import F
 from aiogram.fsm.context import FSMContext
 from aiogram.types import (
+    BufferedInputFile,
     CallbackQuery,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     Message,
 )
-from aiogram.utils.deep_linking import create_start_link
+from aiogram.utils.deep_linking import create_deep_link, create_start_link
 from filters import IsMainAdmin
 from filters import TextBtn as __
 from keyboards import *
 from loader import bot, db_manage, dp
 from locales import get_text as _
-from utils.states import StateCreateDeepLink
+from utils.states import StateCreateDeepLink, StateCreateDeepLinksBulk
+
+# Максимальное количество диплинков, создаваемых за одну пачку
+DEEP_LINKS_BULK_MAX_COUNT = 10000
+
+
+def _csv_document(header: list, rows, filename: str) -> BufferedInputFile:
+    """CSV-файл для отправки в Телеграм."""
+    csv_buffer = io.StringIO()
+    writer = csv.writer(csv_buffer)
+    writer.writerow(header)
+    writer.writerows(rows)
+    return BufferedInputFile(
+        file=csv_buffer.getvalue().encode("utf-8"), filename=filename
+    )
+
+
+def cancel_deep_link_menu():
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text=_("btn_cancel"), callback_data="cancel_deep_link"
+                )
+            ]
+        ]
+    )
 
 
 # Меню создания диплинка подписки
@@ -22,16 +52,7 @@ async def deep_link_menu(message: Message, state: FSMContext):
     await state.set_state(StateCreateDeepLink.days)
 
     await message.answer(
-        text=_("deep_link_enter_days"),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text=_("btn_cancel"), callback_data="cancel_deep_link"
-                    )
-                ]
-            ]
-        ),
+        text=_("deep_link_enter_days"), reply_markup=cancel_deep_link_menu()
     )
 
 
@@ -75,24 +96,120 @@ async def process_deep_link_days(message: Message, state: FSMContext):
     )
 
 
+# Меню создания пачки диплинков подписки
+@dp.message(__("btn_create_deep_links_bulk"), IsMainAdmin())
+async def deep_links_bulk_menu(message: Message, state: FSMContext):
+    await state.clear()
+    await state.set_state(StateCreateDeepLinksBulk.days)
+
+    await message.answer(
+        text=_("deep_link_enter_days"), reply_markup=cancel_deep_link_menu()
+    )
+
+
+# Получение количества дней для пачки диплинков
+@dp.message(StateCreateDeepLinksBulk.days, IsMainAdmin())
+async def process_deep_links_bulk_days(message: Message, state: FSMContext):
+    try:
+        days = int(message.text.strip())
+        if days <= 0:
+            raise ValueError
+    except ValueError:
+        await message.answer(_("deep_link_positive_integer"))
+        return
+
+    await state.update_data(days=days)
+    await state.set_state(StateCreateDeepLinksBulk.count)
+
+    await message.answer(
+        text=_("deep_link_bulk_enter_count", max_count=DEEP_LINKS_BULK_MAX_COUNT),
+        reply_markup=cancel_deep_link_menu(),
+    )
+
+
+# Получение количества диплинков, генерация пачки и выгрузка в CSV
+@dp.message(StateCreateDeepLinksBulk.count, IsMainAdmin())
+async def process_deep_links_bulk_count(message: Message, state: FSMContext):
+    try:
+        count = int(message.text.strip())
+        if not 0 < count <= DEEP_LINKS_BULK_MAX_COUNT:
+            raise ValueError
+    except ValueError:
+        await message.answer(
+            _("deep_link_bulk_count_range", max_count=DEEP_LINKS_BULK_MAX_COUNT)
+        )
+        return
+
+    days = (await state.get_data())["days"]
+    await state.clear()
+
+    deep_links = await db_manage.create_deep_links_bulk(days, count)
+
+    bot_info = await bot.me()
+    rows = [
+        [
+            deep_link_str,
+            create_deep_link(bot_info.username, "start", deep_link_str),
+            days,
+        ]
+        for deep_link_str in deep_links
+    ]
+
+    await message.answer_document(
+        document=_csv_document(
+            ["deep_link", "start_link", "duration_days"],
+            rows,
+            f"deep_links_{days}d_{count}.csv",
+        ),
+        caption=_("deep_link_bulk_created", count=count, days=days),
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[
+                [InlineKeyboardButton(text=_("btn_main_menu"), callback_data="start")]
+            ]
+        ),
+    )
+
+
 # Просмотр списка созданных диплинков
 @dp.callback_query(F.data == "list_deep_links", IsMainAdmin())
 async def list_deep_links_handler(query: CallbackQuery):
-    deep_links = await db_manage.list_deep_links()
-    if not deep_links:
+    # Диплинков могут быть тысячи: одним CSV-файлом вместо сотен сообщений,
+    # которые упёрлись бы в лимиты Телеграм на частоту отправки
+    bot_info = await bot.me()
+    rows = []
+    active = 0
+    async for deep_links in db_manage.iter_deep_links():
+        for dl in deep_links:
+            active += bool(dl.is_active)
+            rows.append(
+                [
+                    dl.deep_link,
+                    create_deep_link(bot_info.username, "start", dl.deep_link),
+                    dl.duration_days,
+                    "active" if dl.is_active else "used",
+                    dl.created_at or "",
+                    dl.activated_at or "",
+                    dl.activated_by_user_id or "",
+                ]
+            )
+
+    if not rows:
         await query.message.answer(_("deep_link_no_links"))
         return
 
-    text_lines = ["<b>Список диплинков подписки:</b>\n"]
-    for dl in deep_links:
-        status = "🟢 Активен" if dl.is_active else "🔴 Использован"
-        activated = (
-            f", активирован пользователем {dl.activated_by_user_id}"
-            if dl.activated_at
-            else ""
-        )
-        text_lines.append(
-            f"• <code>{dl.deep_link}</code> — {dl.duration_days} дней ({status}){activated}"
-        )
-
-    await query.message.answer("\n".join(text_lines))
+    await query.message.answer_document(
+        document=_csv_document(
+            [
+                "deep_link",
+                "start_link",
+                "duration_days",
+                "status",
+                "created_at",
+                "activated_at",
+                "activated_by_user_id",
+            ],
+            rows,
+            "deep_links.csv",
+        ),
+        caption=_("deep_link_list_exported", count=len(rows), active=active),
+    )
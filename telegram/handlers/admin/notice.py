@@ -1,4 +1,6 @@
 import asyncio
+import os
+import tempfile
 
 from aiogram import F
 from aiogram.exceptions import (
@@ -8,8 +10,8 @@ from aiogram.exceptions import (
 )
 from aiogram.fsm.context import FSMContext
 from aiogram.types import (
-    BufferedInputFile,
     CallbackQuery,
+    FSInputFile,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     Message,
@@ -46,6 +48,11 @@ async def show_info_about_users_bot(message: Message, state: FSMContext):
                         text=_("admin_download_ids"), callback_data="down_users_id"
                     )
                 ],
+                [
+                    InlineKeyboardButton(
+                        text=_("admin_report_button"), callback_data="rollup_report"
+                    )
+                ],
             ]
         ),
     )
@@ -54,15 +61,19 @@ async def show_info_about_users_bot(message: Message, state: FSMContext):
 # Выгрузка id всех пользователей
 @dp.callback_query(F.data == "down_users_id", IsAdmin())
 async def down_users_id(query: CallbackQuery, state: FSMContext):
-    users_id = await db_manage.get_users_id()
-
-    users_id_str = ""
-    for user_id in users_id:
-        users_id_str += f"{user_id[0]}\n"
-
-    await query.message.answer_document(
-        document=BufferedInputFile(file=users_id_str.encode(), filename="users.txt")
-    )
+    # Пишем id порциями во временный файл, чтобы не держать всю выгрузку в памяти
+    with tempfile.NamedTemporaryFile(
+        mode="w", suffix=".txt", delete=False, encoding="utf-8"
+    ) as users_file:
+        async for users_id in db_manage.iter_users_id():
+            users_file.write("".join(f"{user_id}\n" for user_id in users_id))
+
+    try:
+        await query.message.answer_document(
+            document=FSInputFile(users_file.name, filename="users.txt")
+        )
+    finally:
+        os.remove(users_file.name)
 
 
 # Настройка рассылки
@@ -93,7 +104,8 @@ async def stop_mailing(query: CallbackQuery, state: FSMContext):
 # Получение сообщения для расылки
 @dp.message(State_Mailing.msg, IsAdmin())
 async def take_msg_mailing(message: Message, state: FSMContext):
-    users = await db_manage.get_users_id()
+    # Сами id читаются порциями во время рассылки (db_manage.iter_users_id)
+    total_users = await db_manage.count_users()
     text_buttons = []
     urls = []
 
@@ -151,7 +163,7 @@ async def take_msg_mailing(message: Message, state: FSMContext):
     @dp.callback_query(F.data == "confirm_start_mailing", IsAdmin())
     async def confirm_start_mailing(query: CallbackQuery, state: FSMContext):
         await query.message.answer(
-            text=f"Начать рассылку?\n\nРасчетное время рассылки: {round(len(users) * 0.05, 0)}",
+            text=f"Начать рассылку?\n\nРасчетное время рассылки: {round(total_users * 0.05, 0)}",
             reply_markup=InlineKeyboardMarkup(
                 inline_keyboard=[
                     [
@@ -178,50 +190,56 @@ async def take_msg_mailing(message: Message, state: FSMContext):
             builder.adjust(1)
 
         # Для расчета прогресса
-        ind = round(len(users) / 5, 0)
+        ind = round(total_users / 5, 0)
         if ind == 0:
             ind = 1
 
+        # Рассылка идёт долго — не держим соединение единицы работы
+        await db_manage.commit_unit_of_work()
+
         count_msg = []
-        for index, user in enumerate(users):
-            if index % ind == 0:
-                await message.answer(
-                    text=_("admin_mailing_progress", progress=int(index / ind * 20))
-                )
-
-            # Обработка отправки
-            async def send_msg():
-                try:
-                    await bot.copy_message(
-                        chat_id=user[0],
-                        from_chat_id=message.from_user.id,
-                        message_id=message.message_id,
-                        reply_markup=builder.as_markup(),
+        index = 0
+        async for users_id in db_manage.iter_users_id():
+            for user_id in users_id:
+                if index % ind == 0:
+                    await message.answer(
+                        text=_("admin_mailing_progress", progress=int(index / ind * 20))
                     )
 
-                    count_msg.append(1)
-                    print(f"Отправил сообщение {index + 1}")
+                # Обработка отправки
+                async def send_msg():
+                    try:
+                        await bot.copy_message(
+                            chat_id=user_id,
+                            from_chat_id=message.from_user.id,
+                            message_id=message.message_id,
+                            reply_markup=builder.as_markup(),
+                        )
+
+                        count_msg.append(1)
+                        print(f"Отправил сообщение {index + 1}")
 
-                except TelegramRetryAfter as e:
-                    print("Ошбика попробую через", e.retry_after)
-                    await asyncio.sleep(e.retry_after)
-                    await send_msg()
+                    except TelegramRetryAfter as e:
+                        print("Ошбика попробую через", e.retry_after)
+                        await asyncio.sleep(e.retry_after)
+                        await send_msg()
 
-                except TelegramBadRequest as e:
-                    print(e)
+                    except TelegramBadRequest as e:
+                        print(e)
 
-                except TelegramForbiddenError as e:
-                    print(e)
+                    except TelegramForbiddenError as e:
+                        print(e)
 
-            await send_msg()
-            await asyncio.sleep(1 / 20)
+                await send_msg()
+                await asyncio.sleep(1 / 20)
+                index += 1
 
         count_msg_len = len(count_msg)
         await message.answer(
             text=_(
                 "admin_mailing_completed",
-                total_users=len(users),
+                total_users=index,
                 success_count=count_msg_len,
-                failed_count=len(users) - count_msg_len,
+                failed_count=index - count_msg_len,
             )
         )
@@ -0,0 +1,16 @@
+from aiogram import filters
+from aiogram.types import Message
+from filters import IsMainAdmin
+from loader import dp, marzban_client
+
+from ..common import answer_json_stats
+
+
+####МЕТРИКИ КЛИЕНТА ПАНЕЛИ: КЭШ ПОЛЬЗОВАТЕЛЕЙ####
+#################################################
+@dp.message(filters.Command("panel_stats"), IsMainAdmin())
+async def panel_stats(message: Message):
+    await answer_json_stats(message, marzban_client.stats())
+
+
+#################################################
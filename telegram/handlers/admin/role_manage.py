@@ -27,10 +27,10 @@ async def admin_manage_menu(message: Message, state: FSMContext):
 
     text = f"<b>{_('admin_all_administrators')}</b>"
     for admin in admins:
-        if int(admin[0]) == int(TG_ADMIN):
+        if int(admin.user_id) == int(TG_ADMIN):
             pass
         else:
-            text += f'\n\n{admin[5]} <a href="tg://user?id={admin[0]}">{admin[2]}</a> ID: {admin[0]}'
+            text += f'\n\n{admin.status_user} <a href="tg://user?id={admin.user_id}">{admin.first_name}</a> ID: {admin.user_id}'
 
     await message.answer(
         text=text,
@@ -0,0 +1,71 @@
+from aiogram import F, filters
+from aiogram.types import CallbackQuery, Message
+from filters import IsAdmin, IsMainAdmin
+from loader import db_manage, dp
+from locales import get_text as _
+
+REPORT_DAYS = 30
+
+
+def _format_amount(amount: int, currency: str) -> str:
+    # Суммы хранятся в минимальных единицах валюты; у звёзд (XTR) их нет
+    if currency == "XTR":
+        return f"{amount} {currency}"
+    return f"{amount / 100:.2f} {currency}"
+
+
+def _format_revenue(revenue: dict) -> str:
+    return (
+        ", ".join(
+            f"{_format_amount(total, currency)} ×{count}"
+            for currency, (count, total) in sorted(revenue.items())
+        )
+        or "0"
+    )
+
+
+####ОТЧЁТ ПО ДНЯМ ИЗ СВОДНЫХ ТАБЛИЦ####
+#######################################
+@dp.callback_query(F.data == "rollup_report", IsAdmin())
+async def rollup_report(query: CallbackQuery):
+    report = await db_manage.get_rollup_report(days=REPORT_DAYS)
+
+    if not report["users"] and not report["revenue"]:
+        await query.message.answer(text=_("admin_report_empty", days=REPORT_DAYS))
+        return
+
+    days: dict = {}
+    total_revenue: dict = {}
+    for day, signups, first_payments in report["users"]:
+        days.setdefault(day, {"users": (0, 0), "revenue": {}})
+        days[day]["users"] = (signups, first_payments)
+    for day, currency, count, total in report["revenue"]:
+        days.setdefault(day, {"users": (0, 0), "revenue": {}})
+        days[day]["revenue"][currency] = (count, total)
+        prev_count, prev_total = total_revenue.get(currency, (0, 0))
+        total_revenue[currency] = (prev_count + count, prev_total + total)
+
+    lines = [
+        f"{day:%d.%m} 👤 +{row['users'][0]} 💳 {row['users'][1]} · "
+        f"{_format_revenue(row['revenue'])}"
+        for day, row in sorted(days.items(), reverse=True)
+    ]
+
+    text = _(
+        "admin_report_text",
+        days=REPORT_DAYS,
+        signups=sum(signups for _day, signups, _first in report["users"]),
+        first_payments=sum(first for _day, _signups, first in report["users"]),
+        revenue=_format_revenue(total_revenue),
+    )
+    await query.message.answer(text=f"{text}\n\n<pre>" + "\n".join(lines) + "</pre>")
+
+
+# Пересчёт сводных таблиц из payments и users
+@dp.message(filters.Command("report_rebuild"), IsMainAdmin())
+async def rollup_rebuild(message: Message):
+    days = await db_manage.rebuild_rollups()
+    await message.answer(text=_("admin_report_rebuilt", days=days))
+
+
+#######################################
@@ -1,3 +1,5 @@
+import html
+import json
 import logging
 
 from aiogram.exceptions import TelegramBadRequest
@@ -10,9 +12,31 @@ from loader import (
     bot,
     load_menu_image,
 )
+from utils.marzban_api import MarzbanAPIError, MarzbanUnavailableError
 
 logger = logging.getLogger(__name__)
 
+# Максимальная длина текста сообщения в Телеграм
+MESSAGE_MAX_LENGTH = 4096
+
+
+def panel_error_key(error: MarzbanAPIError) -> str:
+    """Ключ локализации для ответа пользователю на ошибку панели."""
+    if isinstance(error, MarzbanUnavailableError):
+        return "panel_unavailable"
+    return "my_keys_error_get_data"
+
+
+async def answer_json_stats(message: Message, stats: dict) -> None:
+    """Отправляет метрики JSON'ом в <pre>, несколькими сообщениями при необходимости."""
+    text = json.dumps(stats, ensure_ascii=False, indent=1, default=str)
+    # Режем на сообщения с запасом под теги <pre>
+    chunk_size = MESSAGE_MAX_LENGTH - 100
+    for start in range(0, len(text), chunk_size):
+        await message.answer(
+            text=f"<pre>{html.escape(text[start:start + chunk_size])}</pre>"
+        )
+
 
 # Функция для редактирования меню с изображением
 async def edit_menu_with_image(
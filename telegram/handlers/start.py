@@ -54,21 +54,15 @@ async def process_start_bot_deep_link(
         await process_start_bot(message, message.from_user.id)
         return
 
-    deep_link_info = await db_manage.get_deep_link(args)
-    if deep_link_info is not None:
-        # Диплинк активен, активируем подписку
-        user_id = message.from_user.id
-
-        # Активируем диплинк (помечаем использованным)
-        success = await db_manage.activate_deep_link(args, user_id)
-        if not success:
-            # Что-то пошло не так (возможно, уже использован)
-            await process_start_bot(message, user_id)
-            return
-
+    # Активируем диплинк (помечаем использованным) одним условным UPDATE
+    user_id = message.from_user.id
+    duration_days = await db_manage.activate_deep_link(args, user_id)
+    if duration_days is not None:
+        # Диплинк был активен, активируем подписку
         # Продлеваем подписку пользователя через Marzban
         try:
-            user_marz = await marzban_client.get_user(str(user_id))
+            # Новая дата считается от текущей — читаем панель в обход кэша
+            user_marz = await marzban_client.get_user(str(user_id), fresh=True)
             # Определяем текущую дату истечения
             if user_marz.expire:
                 # Если expire это timestamp (int), конвертируем в datetime
@@ -84,7 +78,7 @@ async def process_start_bot_deep_link(
                 current_expire = datetime.now()
 
             # Добавляем дни из диплинка
-            new_expire = current_expire + timedelta(days=deep_link_info.duration_days)
+            new_expire = current_expire + timedelta(days=duration_days)
 
             modify_user = UserModify(
                 expire=new_expire,
@@ -99,14 +93,13 @@ async def process_start_bot_deep_link(
                     username=str(user_id),
                     note=f"{message.from_user.first_name} @{message.from_user.username}",
                     status=UserStatusCreate.active,
-                    expire=datetime.now()
-                    + timedelta(days=deep_link_info.duration_days),
+                    expire=datetime.now() + timedelta(days=duration_days),
                     group_ids=[1],
                     proxy_settings=ProxyTable(
                         vless=VlessSettings(flow=XTLSFlows.VISION)
                     ),
                 )
-                user_marz = await marzban_client.create_user(new_user)
+                user_marz = await marzban_client.create_user(new_user, optimistic=True)
             else:
                 # Ошибка API, логируем и продолжаем обычный старт
                 print(f"Marzban API error: {e.message}")
@@ -115,16 +108,14 @@ async def process_start_bot_deep_link(
 
         # Обновляем поле trial в таблице users (если нужно)
         user_tg = await db_manage.get_user_by_id(user_id)
-        if user_tg and user_tg[7] == "true":
+        if user_tg and user_tg.trial == "true":
             await db_manage.update_user(user_id, trial="false")
 
-        await message.answer(
-            text=_("admin_subscription_activated", days=deep_link_info.duration_days)
-        )
+        await message.answer(text=_("admin_subscription_activated", days=duration_days))
         await process_start_bot(message, user_id)
         return
 
-    # 3. Если диплинк не найден, обычный старт
+    # 3. Если диплинк не найден или уже использован, обычный старт
     await process_start_bot(message, message.from_user.id)
 
 
@@ -150,15 +141,15 @@ async def inline_process_start_bot(query: CallbackQuery, state: FSMContext):
 async def process_start_bot(message: Message | CallbackQuery, user_id: str | int):
     user = await db_manage.get_user_by_id(user_id)
 
-    if user is None:
-        # Получаем объект пользователя в зависимости от типа message
-        if isinstance(message, CallbackQuery):
-            from_user = message.from_user
-            msg_obj = message.message
-        else:
-            from_user = message.from_user
-            msg_obj = message
+    # Получаем объект пользователя в зависимости от типа message
+    if isinstance(message, CallbackQuery):
+        from_user = message.from_user
+        msg_obj = message.message
+    else:
+        from_user = message.from_user
+        msg_obj = message
 
+    if user is None:
         await db_manage.add_new_user(
             from_user.id,
             from_user.username or "",
@@ -171,27 +162,28 @@ async def process_start_bot(message: Message | CallbackQuery, user_id: str | int
 
         return
 
-    # Проверяем, принял ли пользователь правила
-    if not user[8]:  # rules_accepted находится на 8-й позиции (индекс 8)
-        # Нужен объект Message
-        if isinstance(message, CallbackQuery):
-            msg_obj = message.message
-        else:
-            msg_obj = message
+    # Пользователь сменил имя/username в Телеграм — обновляем (тот же upsert)
+    if from_user.id == user.user_id and (
+        (user.username or "") != (from_user.username or "")
+        or (user.first_name or "") != (from_user.first_name or "")
+        or (user.last_name or "") != (from_user.last_name or "")
+    ):
+        await db_manage.add_new_user(
+            from_user.id,
+            from_user.username or "",
+            from_user.first_name or "",
+            from_user.last_name or "",
+        )
 
+    # Проверяем, принял ли пользователь правила
+    if not user.rules_accepted:
         await msg_obj.answer(text=_("rules_text"), reply_markup=rules_menu())
         return
 
-    # Нужен объект Message
-    if isinstance(message, CallbackQuery):
-        msg_obj = message.message
-    else:
-        msg_obj = message
-
     await bot.set_my_commands(commands=user_commands, scope=BotCommandScopeDefault())
 
     menu_keyboards = {
-        "user": user_menu(user[7]),
+        "user": user_menu(user.trial),
         "admin": admin_menu(),
         "main_admin": main_admin_menu(),
     }
@@ -226,7 +218,7 @@ async def process_start_bot(message: Message | CallbackQuery, user_id: str | int
             outgoing_gb=outgoing_gb,
         )
 
-    status = user[5] if user else None
+    status = user.status_user if user else None
 
     # Определяем клавиатуру и текст
     if (
@@ -235,7 +227,12 @@ async def process_start_bot(message: Message | CallbackQuery, user_id: str | int
         and msg_obj.text == "/start"
     ):
         keyboard = menu_keyboards[status]
-        text_admin = await get_admin_text()
+        try:
+            text_admin = await get_admin_text()
+        except MarzbanAPIError as e:
+            # Статистика панели недоступна — меню админа всё равно показываем
+            print(f"Marzban API error: {e.message}")
+            text_admin = _("panel_unavailable")
 
         await msg_obj.answer(text=text_admin, reply_markup=keyboard)
 
@@ -243,5 +240,5 @@ async def process_start_bot(message: Message | CallbackQuery, user_id: str | int
 
     # Отправляем меню с изображением
     await edit_menu_with_image(
-        event=msg_obj, text=text, reply_markup=user_menu(str(user[7]))
+        event=msg_obj, text=text, reply_markup=user_menu(str(user.trial))
     )
@@ -14,15 +14,17 @@ from aiogram.types import (
 from keyboards import *
 from loader import db_manage, dp, get_full_subscription_url, marzban_client
 from locales import get_text as _
-from models.user import UserResponse
+from storage import UserRecord
 from utils.marzban_api import MarzbanAPIError
 
-from ..common import edit_menu_with_image
+from ..common import edit_menu_with_image, panel_error_key
 
 
 # Обработчик кнопки "Мой ключ"
 @dp.callback_query(F.data == "my_key")
-async def my_key_handler(query: CallbackQuery, state: FSMContext):
+async def my_key_handler(
+    query: CallbackQuery, state: FSMContext, user_record: UserRecord | None
+):
     await state.clear()
 
     user_id = query.from_user.id
@@ -32,21 +34,24 @@ async def my_key_handler(query: CallbackQuery, state: FSMContext):
             event=query, text=_("my_kyes_no_key"), reply_markup=user_btn_main_menu()
         )
 
-    # Есть ли пользователь в marzban
+    # Есть ли пользователь в marzban (если панель недоступна — последняя копия)
     try:
-        user_marz: UserResponse = await marzban_client.get_user(str(user_id))
-
-        # Если юзер есть в marzban то триала уже не должно быть
-        user_tg = await db_manage.get_user_by_id(user_id)
-        if user_tg[7] == "true":
-            await db_manage.update_user(user_id=user_id, trial="false")
+        user_marz, is_stale = await marzban_client.get_user_or_stale(str(user_id))
     except MarzbanAPIError as e:
         if e.status == 404:
             await message_no_keys()
             return
         print(e)
+        await query.answer(_(panel_error_key(e)))
+        return
+
+    # Если юзер есть в marzban то триала уже не должно быть
+    if user_record and user_record.trial == "true":
+        await db_manage.update_user(user_id=user_id, trial="false")
 
     text = my_keys_stat_info(user_marz)
+    if is_stale:
+        text += "\n\n" + _("my_keys_stale_notice")
     await edit_menu_with_image(
         event=query, text=text, reply_markup=user_my_keys_stat_menu()
     )
@@ -60,7 +65,8 @@ async def get_qr_code_handler(query: CallbackQuery, state: FSMContext):
     user_id = query.from_user.id
 
     try:
-        user_marz: UserResponse = await marzban_client.get_user(str(user_id))
+        # Ссылка на подписку не меняется — устаревшая копия тоже подходит
+        user_marz, _is_stale = await marzban_client.get_user_or_stale(str(user_id))
     except MarzbanAPIError as e:
         if e.status == 404:
             await edit_menu_with_image(
@@ -68,7 +74,7 @@ async def get_qr_code_handler(query: CallbackQuery, state: FSMContext):
             )
             return
         print(e)
-        await query.answer(_("my_keys_error_get_data"))
+        await query.answer(_(panel_error_key(e)))
         return
 
     # Генерация QR-кода из subscription_url
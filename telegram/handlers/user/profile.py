@@ -5,20 +5,22 @@ from keyboards import *
 from loader import db_manage, dp
 from locales import get_text as _
 from locales import update_lang
+from storage import UserRecord
 
 from ..common import edit_menu_with_image
 
 
 # Обработчик кнопки "Профиль"
 @dp.callback_query(F.data == "btn_profile")
-async def profile_handler(query: CallbackQuery, state: FSMContext):
+async def profile_handler(
+    query: CallbackQuery, state: FSMContext, user_record: UserRecord | None
+):
     await state.clear()
 
-    user_id = query.from_user.id
-    user = await db_manage.get_user_by_id(user_id)
+    user = user_record
 
     if user:
-        current_lang = user[6]  # language находится на 6-й позиции (индекс 6)
+        current_lang = user.language
         if current_lang == "ru":
             lang_display = "🇷🇺 Русский"
         elif current_lang == "fa":
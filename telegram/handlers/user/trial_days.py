@@ -8,21 +8,24 @@ from loader import db_manage, dp, get_full_subscription_url, marzban_client
 from locales import get_text as _
 from models.proxy import ProxyTable, VlessSettings, XTLSFlows
 from models.user import UserCreate, UserResponse, UserStatusCreate
+from storage import UserRecord
 from utils.marzban_api import MarzbanAPIError
 
-from ..common import edit_menu_with_image
+from ..common import edit_menu_with_image, panel_error_key
 
 
 # Обработчик кнопки "Пробный период"
 @dp.callback_query(F.data == "trial_bay")
-async def trial_buy_handler(query: CallbackQuery, state: FSMContext):
+async def trial_buy_handler(
+    query: CallbackQuery, state: FSMContext, user_record: UserRecord | None
+):
     await state.clear()
 
     user_id = query.from_user.id
-    user_tg = await db_manage.get_user_by_id(user_id)
+    user_tg = user_record
 
     # Проверяем брал ли уже пользователь пробный
-    if user_tg and user_tg[7] == "false":
+    if user_tg and user_tg.trial == "false":
         # Получаем текущий текст сообщения для редактирования
         if query.message:
             current_text = query.message.text or query.message.caption or ""
@@ -33,7 +36,10 @@ async def trial_buy_handler(query: CallbackQuery, state: FSMContext):
 
     # Если пользователя в marzban нет создаем его
     try:
-        user_marz: UserResponse = await marzban_client.get_user(str(user_id))
+        # Решаем, создавать ли пользователя — читаем панель в обход кэша
+        user_marz: UserResponse = await marzban_client.get_user(
+            str(user_id), fresh=True
+        )
     except MarzbanAPIError as e:
         if e.status == 404:
             # Ошибка в панели, on_hold корректно вообще не работает
@@ -54,10 +60,20 @@ async def trial_buy_handler(query: CallbackQuery, state: FSMContext):
                 group_ids=[1],
                 proxy_settings=ProxyTable(vless=VlessSettings(flow=XTLSFlows.VISION)),
             )
-            user_marz: UserResponse = await marzban_client.create_user(new_user)
+            try:
+                user_marz: UserResponse = await marzban_client.create_user(
+                    new_user, optimistic=True
+                )
+            except MarzbanAPIError as create_error:
+                print(create_error.message)
+                await query.answer(_(panel_error_key(create_error)))
+                return
 
         else:
+            # Пробный период не выдан — не помечаем его использованным
             print(e.message)
+            await query.answer(_(panel_error_key(e)))
+            return
 
     # Пользователь уже получил trial
     await db_manage.update_user(user_id, trial="false")
@@ -72,8 +72,9 @@ async def check_payment_status_handler(query: CallbackQuery, state: FSMContext):
         await query.answer(_("invalid_request"), show_alert=True)
         return
 
-    # Проверяем, есть ли успешные платежи у пользователя
-    payments = await db_manage.get_payments_by_user(user_id)
+    # Проверяем, есть ли успешные платежи у пользователя. Платёж только что
+    # записан вебхуком — читаем с основной БД, реплика может отставать
+    payments = await db_manage.get_payments_by_user(user_id, primary=True)
 
     # Ищем последний успешный платеж
     successful_payment = None
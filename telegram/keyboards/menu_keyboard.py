@@ -139,7 +139,10 @@ def main_admin_menu():
                 KeyboardButton(text=_("btn_admins")),
                 KeyboardButton(text=_("about_users_bot")),
             ],
-            [KeyboardButton(text=_("btn_create_deep_link"))],
+            [
+                KeyboardButton(text=_("btn_create_deep_link")),
+                KeyboardButton(text=_("btn_create_deep_links_bulk")),
+            ],
         ],
         resize_keyboard=True,
     )
@@ -7,9 +7,10 @@ from aiogram.enums import ParseMode
 from aiogram.types import BufferedInputFile
 from dotenv import load_dotenv
 from locales import Locales
-from middleware import DebugModeMiddleware, MyLocalesMiddleware
+from middleware import DbSessionMiddleware, DebugModeMiddleware, MyLocalesMiddleware
 from storage import DB_M
 from utils.marzban_api import MarzbanAPIClient
+from utils.resilience import CircuitBreaker, RetryPolicy
 
 logging.basicConfig(level=logging.INFO)
 
@@ -20,12 +21,57 @@ load_dotenv()
 PASARGUARD_BASE_URL = os.getenv("PASARGUARD_BASE_URL", "").rstrip("/")
 PASARGUARD_ADMIN_USERNAME = os.getenv("PASARGUARD_ADMIN_USERNAME")
 PASARGUARD_ADMIN_PASSWORD = os.getenv("PASARGUARD_ADMIN_PASSWORD")
+# Адрес API панели, если бот на том же хосте: unix:///run/pasarguard/pasarguard.socket
+# (по умолчанию запросы идут на PASARGUARD_BASE_URL)
+PASARGUARD_API_URL = os.getenv("PASARGUARD_API_URL") or None
+# Пул соединений с панелью
+PASARGUARD_CONNECTION_LIMIT = int(os.getenv("PASARGUARD_CONNECTION_LIMIT", "100"))
+PASARGUARD_KEEPALIVE_TIMEOUT = float(os.getenv("PASARGUARD_KEEPALIVE_TIMEOUT", "60"))
+PASARGUARD_DNS_CACHE_TTL = int(os.getenv("PASARGUARD_DNS_CACHE_TTL", "300"))
+# Сколько соединений открыть при старте (0 — не прогревать)
+PASARGUARD_WARMUP_CONNECTIONS = int(os.getenv("PASARGUARD_WARMUP_CONNECTIONS", "2"))
+# Кэш ответов панели по пользователям, секунд (0 — отключить)
+PASARGUARD_USER_CACHE_TTL = float(os.getenv("PASARGUARD_USER_CACHE_TTL", "30"))
+# Сколько ещё показывать последнюю копию пользователя, если панель недоступна, секунд
+PASARGUARD_USER_CACHE_STALE_TTL = float(
+    os.getenv("PASARGUARD_USER_CACHE_STALE_TTL", "3600")
+)
+# Одновременных запросов к панели: всего и для классов webhook/background
+# (интерактивные запросы пользователей ограничены только общим лимитом)
+PASARGUARD_MAX_CONCURRENCY = int(os.getenv("PASARGUARD_MAX_CONCURRENCY", "32"))
+PASARGUARD_WEBHOOK_CONCURRENCY = int(os.getenv("PASARGUARD_WEBHOOK_CONCURRENCY", "16"))
+PASARGUARD_BACKGROUND_CONCURRENCY = int(
+    os.getenv("PASARGUARD_BACKGROUND_CONCURRENCY", "4")
+)
+# Повторы идемпотентных запросов к панели (всего попыток, 1 — без повторов)
+PASARGUARD_RETRY_ATTEMPTS = int(os.getenv("PASARGUARD_RETRY_ATTEMPTS", "3"))
+# Circuit breaker: ошибок подряд до размыкания и пауза до пробного запроса, секунд
+PASARGUARD_BREAKER_THRESHOLD = int(os.getenv("PASARGUARD_BREAKER_THRESHOLD", "5"))
+PASARGUARD_BREAKER_RESET_TIMEOUT = float(
+    os.getenv("PASARGUARD_BREAKER_RESET_TIMEOUT", "30")
+)
 
 
 # Тг бот
 TG_TOKEN = os.getenv("TG_TOKEN")
 TG_ADMIN = os.getenv("TG_ADMIN")
 SQLALCHEMY_DATABASE_URL_TG = os.getenv("SQLALCHEMY_DATABASE_URL_TG")
+# Реплика БД бота для read-only запросов (необязательно)
+SQLALCHEMY_DATABASE_URL_TG_REPLICA = os.getenv("SQLALCHEMY_DATABASE_URL_TG_REPLICA")
+
+# Кэш пользователей бота (0 — отключить)
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+# Отложенная (write-behind) запись update_user, секунд (0 — писать сразу)
+DB_WRITE_BEHIND_INTERVAL = float(os.getenv("DB_WRITE_BEHIND_INTERVAL", "0"))
+# Пул соединений с БД бота и порог логирования медленных запросов, мс
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+# Одна сессия БД (единица работы) на обновление Телеграм. Выключено по
+# умолчанию: транзакция держит соединение всё время хендлера, включая
+# запросы к панели и Телеграм
+DB_SESSION_PER_UPDATE = os.getenv("DB_SESSION_PER_UPDATE", "false").lower() == "true"
 
 YOO_KASSA_PROVIDER_TOKEN = os.getenv("YOO_KASSA_PROVIDER_TOKEN")
 YOO_KASSA_SHOP_ID = os.getenv("YOO_KASSA_SHOP_ID")
@@ -47,18 +93,50 @@ DEBUG = os.getenv("DEBUG", "false").lower() == "true"
 # Если переменная не задана/пустая — ручка уведомлений не поднимается, запуск без http-сервера.
 PASARGUARD_NOTIFY_PATH = (os.getenv("PASARGUARD_NOTIFY_PATH") or "").strip()
 PASARGUARD_NOTIFY_SECRET = os.getenv("PASARGUARD_NOTIFY_SECRET")
+# Сколько дней хранить события уведомлений для дедупликации (0 — не чистить)
+PASARGUARD_NOTIFY_RETENTION_DAYS = int(
+    os.getenv("PASARGUARD_NOTIFY_RETENTION_DAYS", "30")
+)
+PASARGUARD_NOTIFY_RETENTION_INTERVAL = float(
+    os.getenv("PASARGUARD_NOTIFY_RETENTION_INTERVAL", "3600")
+)
 
 bot = Bot(TG_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher()
 
 # Инициализация базы данных
-db_manage = DB_M(SQLALCHEMY_DATABASE_URL_TG)
+db_manage = DB_M(
+    SQLALCHEMY_DATABASE_URL_TG,
+    user_cache_size=USER_CACHE_SIZE,
+    user_cache_ttl=USER_CACHE_TTL,
+    write_behind_interval=DB_WRITE_BEHIND_INTERVAL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    slow_query_ms=DB_SLOW_QUERY_MS,
+    replica_uri=SQLALCHEMY_DATABASE_URL_TG_REPLICA,
+)
 
 # Глобальный клиент Marzban API
 marzban_client = MarzbanAPIClient(
     base_url=PASARGUARD_BASE_URL,
     admin_username=PASARGUARD_ADMIN_USERNAME or "",
     admin_password=PASARGUARD_ADMIN_PASSWORD or "",
+    user_cache_ttl=PASARGUARD_USER_CACHE_TTL,
+    api_url=PASARGUARD_API_URL,
+    connection_limit=PASARGUARD_CONNECTION_LIMIT,
+    keepalive_timeout=PASARGUARD_KEEPALIVE_TIMEOUT,
+    dns_cache_ttl=PASARGUARD_DNS_CACHE_TTL,
+    user_cache_stale_ttl=PASARGUARD_USER_CACHE_STALE_TTL,
+    retry_policy=RetryPolicy(attempts=PASARGUARD_RETRY_ATTEMPTS),
+    circuit_breaker=CircuitBreaker(
+        failure_threshold=PASARGUARD_BREAKER_THRESHOLD,
+        reset_timeout=PASARGUARD_BREAKER_RESET_TIMEOUT,
+    ),
+    max_concurrency=PASARGUARD_MAX_CONCURRENCY,
+    priority_limits={
+        "webhook": PASARGUARD_WEBHOOK_CONCURRENCY,
+        "background": PASARGUARD_BACKGROUND_CONCURRENCY,
+    },
 )
 
 # Глобальный клиент ЮKassa API
@@ -76,13 +154,17 @@ else:
 # Создаем контекст для локализации и регистрируем мидлвару
 locale = Locales()
 
-# Регистрируем middleware для локализации (должен быть первым для установки языка)
+# Регистрируем middleware единицы работы с БД (первым: им пользуются остальные)
+if DB_SESSION_PER_UPDATE is True:
+    dp.update.middleware(DbSessionMiddleware(db_manage))
+
+# Регистрируем middleware для локализации (до остальных, для установки языка)
 locale_middleware = MyLocalesMiddleware(locale, db_manage)
 dp.update.middleware(locale_middleware)
 
 # Регистрируем middleware для режима отладки
 if DEBUG is True:
-    debug_middleware = DebugModeMiddleware(db_manage)
+    debug_middleware = DebugModeMiddleware()
     dp.update.middleware(debug_middleware)
 
 
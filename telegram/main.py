@@ -6,7 +6,10 @@ from handlers import dp
 from loader import (
     BASE_WEBHOOK_URL,
     PASARGUARD_NOTIFY_PATH,
+    PASARGUARD_NOTIFY_RETENTION_DAYS,
+    PASARGUARD_NOTIFY_RETENTION_INTERVAL,
     PASARGUARD_NOTIFY_SECRET,
+    PASARGUARD_WARMUP_CONNECTIONS,
     WEB_SERVER_HOST,
     WEB_SERVER_PORT,
     WEBHOOK_PATH,
@@ -17,6 +20,7 @@ from loader import (
     db_manage,
     dp,
     load_menu_image,
+    marzban_client,
 )
 from notification_webhook import register_pasarguard_notification_route
 from yookassa_webhook import register_yookassa_webhook_route
@@ -37,11 +41,13 @@ def _build_webhook_app() -> web.Application:
 
     async def on_startup(_: web.Application) -> None:
         await db_manage.create_tables()
+        db_manage.start_write_behind()
         # Загружаем изображение меню при запуске
         try:
             await load_menu_image()
         except Exception as e:
             print(f"Ошибка загрузки изображения меню: {e}")
+        await marzban_client.warm_up(PASARGUARD_WARMUP_CONNECTIONS)
 
         if WEBHOOK_PATH:
             await bot.set_webhook(
@@ -53,10 +59,16 @@ def _build_webhook_app() -> web.Application:
     async def on_shutdown(_: web.Application) -> None:
         if WEBHOOK_PATH:
             await bot.delete_webhook(drop_pending_updates=False)
+
+    async def on_cleanup(_: web.Application) -> None:
+        # После всех on_shutdown: фоновые задачи уже остановлены
         await bot.session.close()
+        await marzban_client.close()
+        await db_manage.close()
 
     app.on_startup.append(on_startup)
     app.on_shutdown.append(on_shutdown)
+    app.on_cleanup.append(on_cleanup)
 
     # Ручка для уведомлений от панели (только если путь задан)
     if PASARGUARD_NOTIFY_PATH:
@@ -66,6 +78,9 @@ def _build_webhook_app() -> web.Application:
             bot=bot,
             notify_path=PASARGUARD_NOTIFY_PATH,
             notify_secret=PASARGUARD_NOTIFY_SECRET,
+            retention_days=PASARGUARD_NOTIFY_RETENTION_DAYS,
+            retention_interval=PASARGUARD_NOTIFY_RETENTION_INTERVAL,
+            marzban_client=marzban_client,
         )
 
     # Ручка для уведомлений от ЮKassa
@@ -95,14 +110,20 @@ async def _run_polling():
     """
     await bot.delete_webhook(drop_pending_updates=True)
     await db_manage.create_tables()
+    db_manage.start_write_behind()
     # Загружаем изображение меню при запуске
     try:
         await load_menu_image()
     except Exception as e:
         print(f"Ошибка загрузки изображения меню: {e}")
+    await marzban_client.warm_up(PASARGUARD_WARMUP_CONNECTIONS)
 
-    await dp.start_polling(bot)
-    await bot.session.close()
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await bot.session.close()
+        await marzban_client.close()
+        await db_manage.close()
 
 
 def main():
@@ -4,14 +4,37 @@ from typing import Any, Awaitable, Callable, Dict
 from aiogram import BaseMiddleware
 from locales import Locales, setup_context
 from locales import get_text as _
-from storage import DB_M
+from storage import DB_M, UserRecord
 
 logger = logging.getLogger(__name__)
 
 
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Middleware единицы работы: все вызовы db_manage за время обработки
+    обновления идут через одну сессию БД (одно соединение из пула и одна
+    транзакция), которая фиксируется после хендлера.
+    Должен регистрироваться первым, до MyLocalesMiddleware.
+    """
+
+    def __init__(self, db_manage: DB_M):
+        self.db_manage = db_manage
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event,
+        data: Dict[str, Any],
+    ):
+        async with self.db_manage.unit_of_work():
+            return await handler(event, data)
+
+
 class MyLocalesMiddleware(BaseMiddleware):
     """
-    Middleware, который выбирает язык
+    Middleware, который выбирает язык.
+    Также один раз за обновление загружает запись пользователя из БД
+    и кладёт её в data["user_record"] для фильтров и хендлеров.
     """
 
     def __init__(self, locales: Locales, db_manage: DB_M):
@@ -25,14 +48,16 @@ class MyLocalesMiddleware(BaseMiddleware):
         data: Dict[str, Any],
     ):
         user_id = data["event_chat"].id
-        user_info = await self.db_manage.get_user_by_id(user_id)
+        user_info: UserRecord | None = await self.db_manage.get_user_by_id(user_id)
 
         # Дефолтный язык
         # Определяем язык по умолчанию
         lang = "en"
         # Определяем язык: сначала из базы, если есть, иначе из Телеграм
         lang_source = (
-            str(user_info[6]) if user_info else data["event_from_user"].language_code
+            str(user_info.language)
+            if user_info
+            else data["event_from_user"].language_code
         )
         if lang_source in ("ru", "en", "fa"):
             lang = lang_source
@@ -43,6 +68,7 @@ class MyLocalesMiddleware(BaseMiddleware):
         # Добавляем в data
         data["lang"] = lang
         data["locales"] = self.locales
+        data["user_record"] = user_info
 
         setup_context(self.locales, lang)
 
@@ -54,11 +80,9 @@ class DebugModeMiddleware(BaseMiddleware):
     Middleware для проверки режима отладки.
     Если DEBUG=True, то доступ к боту имеют только администраторы.
     Обычные пользователи получают сообщение о технических работах.
+    Должен регистрироваться после MyLocalesMiddleware (использует data["user_record"]).
     """
 
-    def __init__(self, db_manage: DB_M):
-        self.db_manage = db_manage
-
     async def __call__(
         self,
         handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
@@ -67,10 +91,9 @@ class DebugModeMiddleware(BaseMiddleware):
     ):
 
         # Проверяем статус пользователя, если админ - пропускаем
-        user_id = data["event_chat"].id
-        status_user = await self.db_manage.get_status_user(user_id)
+        user_record: UserRecord | None = data.get("user_record")
 
-        if status_user and status_user[0] in ("admin", "main_admin"):
+        if user_record and user_record.status_user in ("admin", "main_admin"):
             return await handler(event, data)
 
         # Если пользователь не админ, отправляем сообщение о тех. работах
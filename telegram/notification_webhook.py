@@ -1,8 +1,11 @@
 from __future__ import annotations
 
+import asyncio
 import hashlib
 import json
 import logging
+from contextlib import suppress
+from datetime import timedelta
 from typing import Optional
 
 from aiogram import Bot
@@ -12,6 +15,7 @@ from keyboards import *
 from models.notification import Notification, ReachedDaysLeft
 from pydantic import ValidationError
 from storage import DB_M
+from utils.marzban_api import MarzbanAPIClient
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +29,30 @@ def _stable_event_id(payload: dict) -> str:
     return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
 
+async def run_notification_events_retention(
+    db_manage: DB_M,
+    *,
+    retention_days: int,
+    interval: float,
+    batch_size: int = 1000,
+) -> None:
+    """
+    Фоновая задача: периодически удаляет события уведомлений
+    старше retention_days дней (порциями по batch_size записей).
+    """
+    while True:
+        try:
+            deleted = await db_manage.prune_pasarguard_notification_events(
+                timedelta(days=retention_days), batch_size=batch_size
+            )
+            if deleted:
+                logger.info(f"Удалено старых событий уведомлений панели: {deleted}")
+        except Exception as e:
+            logger.error(f"Ошибка очистки событий уведомлений панели: {e}")
+
+        await asyncio.sleep(interval)
+
+
 def register_pasarguard_notification_route(
     app: web.Application,
     *,
@@ -32,9 +60,16 @@ def register_pasarguard_notification_route(
     bot: Bot,
     notify_path: str,
     notify_secret: Optional[str] = None,
+    retention_days: int = 30,
+    retention_interval: float = 3600,
+    marzban_client: MarzbanAPIClient | None = None,
 ) -> None:
     """
     Регистрирует маршрут для приема webhook-уведомлений от панели.
+    Если retention_days > 0, на время жизни приложения запускается
+    фоновая очистка старых событий дедупликации.
+    Если передан marzban_client, любое уведомление о пользователе
+    сбрасывает его из кэша клиента.
     """
     path = (notify_path or "").strip()
     if not path:
@@ -42,6 +77,29 @@ def register_pasarguard_notification_route(
     if not path.startswith("/"):
         path = f"/{path}"
 
+    if retention_days > 0:
+
+        async def start_retention(app: web.Application) -> None:
+            app["pasarguard_events_retention"] = asyncio.create_task(
+                run_notification_events_retention(
+                    db_manage,
+                    retention_days=retention_days,
+                    interval=retention_interval,
+                )
+            )
+
+        async def stop_retention(app: web.Application) -> None:
+            # Дожидаемся отмены: очистка не должна пережить закрытие БД
+            # (оно в on_cleanup, после всех on_shutdown)
+            task = app.get("pasarguard_events_retention")
+            if task is not None:
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+
+        app.on_startup.append(start_retention)
+        app.on_shutdown.append(stop_retention)
+
     async def pasarguard_notify_handler(request: web.Request) -> web.Response:
         # Простая shared-secret аутентификация по заголовку.
         if notify_secret:
@@ -60,6 +118,14 @@ def register_pasarguard_notification_route(
         except Exception:
             return web.json_response({"ok": False, "error": "invalid_json"}, status=400)
 
+        # Пользователи изменились в панели — кэш клиента устарел.
+        # Панель присылает уведомления пачкой, сбрасываем всех
+        if marzban_client is not None:
+            for item in payload_list:
+                username = item.get("username") if isinstance(item, dict) else None
+                if username:
+                    marzban_client.invalidate_user(str(username))
+
         # Все уведомления приходят в общей схеме Notification.*.
         # Нас интересует только reached_days_left, остальные игнорируем.
         action = payload.get("action")
@@ -0,0 +1,277 @@
+"""
+Синтетические данные для БД бота и простой бенчмарк слоя хранения (DB_M).
+
+Работает с любым URL, который поддерживает DB_M, в том числе с SQLite
+без контейнера MySQL. Запускать из каталога telegram/:
+
+    python seed_db.py --users 100000 --payments 20000 --deep-links 5000 --bench
+    python seed_db.py --db-uri sqlite+aiosqlite:///bench.db --users 50000 --drop
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+from storage import (
+    DB_M,
+    DEEP_LINK_ALPHABET,
+    DEEP_LINK_LENGTH,
+    Base,
+    DeepLink,
+    Payment,
+    User,
+)
+
+# Синтетические user_id начинаются отсюда, чтобы не пересекаться с реальными
+USER_ID_BASE = 9_000_000_000
+BATCH_SIZE = 5000
+SEED_CHARGE_PREFIX = "seed-"
+
+
+def _batches(rows_count: int):
+    for start in range(0, rows_count, BATCH_SIZE):
+        yield range(start, min(start + BATCH_SIZE, rows_count))
+
+
+def _random_time(rng: random.Random, now: datetime, days: int) -> datetime:
+    return now - timedelta(seconds=rng.randint(0, days * 24 * 3600))
+
+
+async def seed(
+    db_manage: DB_M,
+    *,
+    users: int,
+    payments: int,
+    deep_links: int,
+    rng: random.Random,
+) -> list[str]:
+    """
+    Заполняет БД пачками по BATCH_SIZE строк и пересчитывает сводные
+    таблицы. Возвращает коды созданных активных диплинков.
+    """
+    now = datetime.now()
+
+    async with db_manage.engine.begin() as conn:
+        for batch in _batches(users):
+            await conn.execute(
+                insert(User),
+                [
+                    {
+                        "user_id": USER_ID_BASE + i,
+                        "username": f"user{i}",
+                        "first_name": f"User {i}",
+                        "last_name": None,
+                        "reg_time": _random_time(rng, now, 365),
+                        "status_user": "admin" if i < 3 else "user",
+                        "language": rng.choice(("ru", "en", "fa")),
+                        "trial": rng.choice(("true", "false")),
+                        "rules_accepted": rng.random() < 0.9,
+                    }
+                    for i in batch
+                ],
+            )
+
+        for batch in _batches(payments if users else 0):
+            rows = []
+            for i in batch:
+                stars = rng.random() < 0.1
+                rows.append(
+                    {
+                        "user_id": USER_ID_BASE + rng.randrange(users),
+                        "provider": "telegram" if stars else "yookassa",
+                        "amount": 100 if stars else 10000,
+                        "currency": "XTR" if stars else "RUB",
+                        "payload": "one_month",
+                        "telegram_payment_charge_id": "",
+                        "provider_payment_charge_id": f"{SEED_CHARGE_PREFIX}{i}",
+                        "payment_date": _random_time(rng, now, 90),
+                        "status": "completed" if rng.random() < 0.95 else "processing",
+                    }
+                )
+            await conn.execute(insert(Payment), rows)
+
+        codes: set[str] = set()
+        while len(codes) < deep_links:
+            codes.add("".join(rng.choices(DEEP_LINK_ALPHABET, k=DEEP_LINK_LENGTH)))
+        codes_list = sorted(codes)
+        active_codes = []
+        for batch in _batches(deep_links):
+            rows = []
+            for i in batch:
+                is_active = rng.random() < 0.7
+                if is_active:
+                    active_codes.append(codes_list[i])
+                rows.append(
+                    {
+                        "deep_link": codes_list[i],
+                        "duration_days": rng.choice((7, 30, 90)),
+                        "is_active": is_active,
+                        "created_at": _random_time(rng, now, 180),
+                        "activated_at": None if is_active else now,
+                        "activated_by_user_id": (
+                            None
+                            if is_active or not users
+                            else USER_ID_BASE + rng.randrange(users)
+                        ),
+                    }
+                )
+            await conn.execute(insert(DeepLink), rows)
+
+    await db_manage.rebuild_rollups()
+    return active_codes
+
+
+async def _measure(name: str, calls) -> None:
+    started = time.perf_counter()
+    count = 0
+    for call in calls:
+        await call()
+        count += 1
+    elapsed = time.perf_counter() - started
+    if count:
+        print(
+            f"{name:<28} {count:>7} вызовов  {elapsed / count * 1000:8.3f} мс/вызов"
+            f"  {count / elapsed:10.0f} в сек"
+        )
+
+
+async def bench(
+    db_manage: DB_M,
+    *,
+    users: int,
+    iterations: int,
+    active_codes: list[str],
+    rng: random.Random,
+) -> None:
+    """Последовательные вызовы горячих методов DB_M на случайных данных."""
+    if not users:
+        print("Бенчмарк пропущен: нет пользователей")
+        return
+
+    def user_ids():
+        return [USER_ID_BASE + rng.randrange(users) for _ in range(iterations)]
+
+    await _measure(
+        "get_user_by_id",
+        (lambda u=u: db_manage.get_user_by_id(u) for u in user_ids()),
+    )
+    await _measure(
+        "get_status_user",
+        (lambda u=u: db_manage.get_status_user(u) for u in user_ids()),
+    )
+    await _measure(
+        "update_user",
+        (
+            lambda u=u: db_manage.update_user(u, language=rng.choice(("ru", "en")))
+            for u in user_ids()
+        ),
+    )
+    await _measure(
+        "add_new_user (existing)",
+        (
+            lambda u=u: db_manage.add_new_user(u, f"user{u}", "Renamed", None)
+            for u in user_ids()
+        ),
+    )
+    await _measure(
+        "get_payments_by_user",
+        (lambda u=u: db_manage.get_payments_by_user(u) for u in user_ids()),
+    )
+    await _measure(
+        "add_payment",
+        (
+            lambda u=u, i=i: db_manage.add_payment(
+                u, 10000, "RUB", "one_month", "", f"{SEED_CHARGE_PREFIX}bench-{i}-{u}"
+            )
+            for i, u in enumerate(user_ids())
+        ),
+    )
+    await _measure(
+        "activate_deep_link",
+        (
+            lambda code=code: db_manage.activate_deep_link(
+                code, USER_ID_BASE + rng.randrange(users)
+            )
+            for code in active_codes[:iterations]
+        ),
+    )
+    await _measure("count_users", (lambda: db_manage.count_users() for _ in range(10)))
+    await _measure(
+        "get_rollup_report",
+        (lambda: db_manage.get_rollup_report(90) for _ in range(10)),
+    )
+
+    stats = db_manage.db_stats()
+    print(
+        f"\nЗапросов к БД: {stats['queries']['total']}, "
+        f"медленных: {stats['queries']['slow']}"
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    db_manage = DB_M(args.db_uri, user_cache_ttl=args.cache_ttl)
+    try:
+        if args.drop:
+            async with db_manage.engine.begin() as conn:
+                await conn.run_sync(Base.metadata.drop_all)
+        await db_manage.create_tables()
+
+        started = time.perf_counter()
+        active_codes = await seed(
+            db_manage,
+            users=args.users,
+            payments=args.payments,
+            deep_links=args.deep_links,
+            rng=rng,
+        )
+        print(
+            f"Создано: пользователей {args.users}, платежей {args.payments}, "
+            f"диплинков {args.deep_links} за {time.perf_counter() - started:.2f} с"
+        )
+
+        if args.bench:
+            await bench(
+                db_manage,
+                users=args.users,
+                iterations=args.iterations,
+                active_codes=active_codes,
+                rng=rng,
+            )
+    finally:
+        await db_manage.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--db-uri",
+        default=os.getenv("SEED_DATABASE_URL", "sqlite+aiosqlite:///:memory:"),
+        help="URL БД (по умолчанию in-memory SQLite)",
+    )
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--payments", type=int, default=2000)
+    parser.add_argument("--deep-links", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0, help="seed генератора")
+    parser.add_argument(
+        "--drop", action="store_true", help="удалить таблицы перед заполнением"
+    )
+    parser.add_argument(
+        "--bench", action="store_true", help="после заполнения прогнать бенчмарк"
+    )
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=0,
+        help="TTL кэша пользователей DB_M, сек (0 — мерить запросы к БД)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -1,27 +1,51 @@
-import random
+import asyncio
+import logging
+import secrets
 import string
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import date, datetime, timedelta
+from typing import NamedTuple, Optional
 
 from sqlalchemy import (
     BigInteger,
     Boolean,
     Column,
+    Date,
     DateTime,
+    Index,
     Integer,
     String,
     UniqueConstraint,
+    delete,
     func,
+    insert,
+    inspect,
     select,
     text,
     update,
 )
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import StaticPool
+from db_metrics import DBMetrics, InstrumentedAsyncQueuePool, timed
+from utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# SQLite автоинкрементит только INTEGER PRIMARY KEY (rowid), не BIGINT
+_BIGINT_PK = BigInteger().with_variant(Integer, "sqlite")
+
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (Index("ix_users_status_user", "status_user"),)
 
     user_id = Column(BigInteger, primary_key=True)
     username = Column(String(64), nullable=True)
@@ -34,11 +58,44 @@ class User(Base):
     rules_accepted = Column(Boolean, default=False)
 
 
+class UserRecord(NamedTuple):
+    """
+    Строка таблицы users в виде неизменяемого кортежа без __dict__.
+    Заполняется выборкой колонок (см. _USER_RECORD_COLUMNS), без ORM-объектов
+    и identity map; обращаться к полям нужно по именам.
+    """
+
+    user_id: int
+    username: Optional[str]
+    first_name: str
+    last_name: Optional[str]
+    reg_time: Optional[datetime]
+    status_user: str
+    language: str
+    trial: str
+    rules_accepted: bool
+
+
+# Колонки users в порядке полей UserRecord: select(*_USER_RECORD_COLUMNS)
+_USER_RECORD_COLUMNS = tuple(getattr(User, field) for field in UserRecord._fields)
+
+
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (
+        Index("ix_payments_user_id_payment_date", "user_id", "payment_date"),
+        # Идемпотентность: один платёж провайдера — одна строка
+        Index(
+            "uq_payments_provider_charge_id",
+            "provider",
+            "provider_payment_charge_id",
+            unique=True,
+        ),
+    )
 
-    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    id = Column(_BIGINT_PK, primary_key=True, autoincrement=True)
     user_id = Column(BigInteger, nullable=False)
+    provider = Column(String(32), nullable=False, server_default="yookassa")
     amount = Column(Integer, nullable=False)
     currency = Column(String(3), nullable=False)
     payload = Column(String(255), nullable=False)
@@ -46,12 +103,18 @@ class Payment(Base):
     provider_payment_charge_id = Column(String(255), nullable=True)
     payment_date = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
     status = Column(String(20), default="completed")
+    # Когда платёж заняли на обработку (status="processing"), по часам БД
+    claimed_at = Column(DateTime, nullable=True)
+    # Когда начали применять платёж (продлевать подписку): после этого
+    # перезанявший платёж повтор не должен применять его ещё раз
+    applied_at = Column(DateTime, nullable=True)
 
 
 class DeepLink(Base):
     __tablename__ = "deep_links"
+    __table_args__ = (Index("ix_deep_links_created_at", "created_at"),)
 
-    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    id = Column(_BIGINT_PK, primary_key=True, autoincrement=True)
     deep_link = Column(String(32), unique=True, nullable=False)
     duration_days = Column(Integer, nullable=False)
     is_active = Column(Boolean, default=True)
@@ -70,9 +133,10 @@ class PasarguardNotificationEvent(Base):
         UniqueConstraint(
             "source", "event_id", name="uq_pasarguard_event_source_event_id"
         ),
+        Index("ix_pasarguard_events_received_at", "received_at"),
     )
 
-    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    id = Column(_BIGINT_PK, primary_key=True, autoincrement=True)
     source = Column(String(64), nullable=False, default="pasarguard")
     event_id = Column(String(128), nullable=False)
     user_id = Column(BigInteger, nullable=False)
@@ -80,24 +144,648 @@ class PasarguardNotificationEvent(Base):
     received_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
 
 
+class SchemaVersion(Base):
+    """
+    Применённые миграции схемы БД бота (см. MIGRATIONS).
+    """
+
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String(255), nullable=False)
+    applied_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
+
+
+class DailyRevenue(Base):
+    """
+    Сводная таблица выручки: платежи со status="completed" по дням и валютам.
+    Поддерживается инкрементально в add_payment/complete_payment,
+    пересчитывается целиком DB_M.rebuild_rollups.
+    """
+
+    __tablename__ = "daily_revenue"
+
+    day = Column(Date, primary_key=True)
+    currency = Column(String(3), primary_key=True)
+    payments_count = Column(Integer, nullable=False, default=0)
+    # В минимальных единицах валюты, как payments.amount
+    amount_total = Column(BigInteger, nullable=False, default=0)
+
+
+class DailyUserStats(Base):
+    """
+    Сводная таблица пользователей по дням: регистрации и первые оплаты
+    (конверсия в платящих). Поддерживается в add_new_user/add_payment.
+    """
+
+    __tablename__ = "daily_user_stats"
+
+    day = Column(Date, primary_key=True)
+    signups = Column(Integer, nullable=False, default=0)
+    first_payments = Column(Integer, nullable=False, default=0)
+
+
+def _upsert_stmt(dialect_name: str, model, values: dict, set_):
+    """
+    INSERT с обновлением при конфликте по первичному ключу:
+    ON DUPLICATE KEY UPDATE (MySQL) или ON CONFLICT DO UPDATE (SQLite).
+    set_(inserted) получает вставляемые значения (VALUES()/excluded)
+    и возвращает словарь обновляемых колонок.
+    """
+    if dialect_name == "sqlite":
+        stmt = sqlite_insert(model).values(**values)
+        return stmt.on_conflict_do_update(
+            index_elements=list(model.__table__.primary_key.columns),
+            set_=set_(stmt.excluded),
+        )
+    stmt = mysql_insert(model).values(**values)
+    return stmt.on_duplicate_key_update(**set_(stmt.inserted))
+
+
+def _insert_ignore_stmt(model):
+    """INSERT, пропускающий строку при нарушении уникального ключа."""
+    return (
+        insert(model)
+        .prefix_with("IGNORE", dialect="mysql")
+        .prefix_with("OR IGNORE", dialect="sqlite")
+    )
+
+
+def _db_now_minus(dialect_name: str, seconds: float):
+    """
+    Момент "сейчас минус seconds" по часам БД — тем же, что у
+    CURRENT_TIMESTAMP / func.now() в записываемых строках.
+    """
+    seconds = int(seconds)
+    if dialect_name == "sqlite":
+        return func.datetime("now", f"-{seconds} seconds")
+    return func.date_sub(func.now(), text(f"INTERVAL {seconds} SECOND"))
+
+
+def _db_days_ago(dialect_name: str, days: int):
+    """
+    Дата "сегодня минус days дней" по часам БД — тем же, что у
+    CURRENT_DATE, которым помечаются дни сводных таблиц.
+    """
+    days = int(days)
+    if dialect_name == "sqlite":
+        return func.date("now", f"-{days} days")
+    return func.date_sub(func.current_date(), text(f"INTERVAL {days} DAY"))
+
+
+def _increment_stmt(dialect_name: str, model, keys: dict, increments: dict):
+    """INSERT строки сводной таблицы или прибавление к счётчикам, если она есть."""
+    return _upsert_stmt(
+        dialect_name,
+        model,
+        {**keys, **increments},
+        lambda inserted: {
+            name: getattr(model, name) + inserted[name] for name in increments
+        },
+    )
+
+
+def _rebuild_rollups(conn) -> int:
+    """
+    Пересчитать сводные таблицы из payments и users. Группировка по дням
+    выполняется в БД, в память попадает O(дней) строк.
+    Возвращает количество дней с данными.
+    """
+    completed = Payment.status == "completed"
+
+    revenue_day = func.date(Payment.payment_date, type_=Date)
+    revenue = conn.execute(
+        select(revenue_day, Payment.currency, func.count(), func.sum(Payment.amount))
+        .where(completed)
+        .group_by(revenue_day, Payment.currency)
+    ).all()
+
+    signup_day = func.date(User.reg_time, type_=Date)
+    signups = conn.execute(select(signup_day, func.count()).group_by(signup_day)).all()
+
+    first_paid = (
+        select(func.min(Payment.payment_date).label("paid_at"))
+        .where(completed)
+        .group_by(Payment.user_id)
+        .subquery()
+    )
+    first_day = func.date(first_paid.c.paid_at, type_=Date)
+    first_payments = conn.execute(
+        select(first_day, func.count()).group_by(first_day)
+    ).all()
+
+    users_by_day: dict[date, dict] = {}
+    for day, count in signups:
+        if day is not None:
+            users_by_day.setdefault(day, {"signups": 0, "first_payments": 0})
+            users_by_day[day]["signups"] = count
+    for day, count in first_payments:
+        if day is not None:
+            users_by_day.setdefault(day, {"signups": 0, "first_payments": 0})
+            users_by_day[day]["first_payments"] = count
+
+    conn.execute(delete(DailyRevenue))
+    conn.execute(delete(DailyUserStats))
+    revenue_rows = [
+        {
+            "day": day,
+            "currency": currency,
+            "payments_count": count,
+            "amount_total": int(total or 0),
+        }
+        for day, currency, count, total in revenue
+        if day is not None
+    ]
+    if revenue_rows:
+        conn.execute(insert(DailyRevenue), revenue_rows)
+    if users_by_day:
+        conn.execute(
+            insert(DailyUserStats),
+            [{"day": day, **counts} for day, counts in users_by_day.items()],
+        )
+
+    return len({row["day"] for row in revenue_rows} | users_by_day.keys())
+
+
+# ------------------------------------------------------------------
+# Миграции схемы
+# ------------------------------------------------------------------
+# Каждая миграция — синхронная функция, принимающая Connection
+# (выполняется через AsyncConnection.run_sync). Миграции должны быть
+# идемпотентными: на новой БД create_all уже создаёт актуальную схему.
+
+
+def _create_indexes(conn, *names: str) -> None:
+    """Создать индексы, объявленные в моделях, если их ещё нет в БД."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in names:
+                index.create(conn, checkfirst=True)
+
+
+def _migration_0001_hot_indexes(conn) -> None:
+    _create_indexes(
+        conn,
+        "ix_users_status_user",
+        "ix_payments_user_id_payment_date",
+        "ix_deep_links_created_at",
+        "ix_pasarguard_events_received_at",
+    )
+
+
+def _migration_0002_payments_provider_unique(conn) -> None:
+    columns = {c["name"] for c in inspect(conn).get_columns(Payment.__tablename__)}
+    if "provider" not in columns:
+        # До этой версии платежи записывал только вебхук ЮKassa
+        column_type = Payment.provider.type.compile(conn.dialect)
+        conn.execute(
+            text(
+                f"ALTER TABLE {Payment.__tablename__} ADD COLUMN provider "
+                f"{column_type} NOT NULL DEFAULT 'yookassa'"
+            )
+        )
+
+    # Оставляем первую запись каждого платежа, повторы от ретраев вебхука
+    # удаляем (через производную таблицу — MySQL не даёт ссылаться на
+    # изменяемую таблицу в подзапросе напрямую)
+    keep = (
+        select(func.min(Payment.id).label("id"))
+        .where(Payment.provider_payment_charge_id.is_not(None))
+        .group_by(Payment.provider, Payment.provider_payment_charge_id)
+        .subquery("keep")
+    )
+    result = conn.execute(
+        delete(Payment).where(
+            Payment.provider_payment_charge_id.is_not(None),
+            Payment.id.not_in(select(keep.c.id)),
+        )
+    )
+    if result.rowcount:
+        logger.warning(f"Удалено дублей платежей: {result.rowcount}")
+
+    _create_indexes(conn, "uq_payments_provider_charge_id")
+
+
+def _migration_0003_rollups(conn) -> None:
+    # Таблицы создал create_all, заполняем их по уже накопленным данным
+    _rebuild_rollups(conn)
+
+
+def _add_nullable_column(conn, column) -> None:
+    """ALTER TABLE ... ADD COLUMN для nullable-колонки модели, если её ещё нет."""
+    table = column.table.name
+    columns = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column.name not in columns:
+        column_type = column.type.compile(conn.dialect)
+        conn.execute(
+            text(f"ALTER TABLE {table} ADD COLUMN {column.name} {column_type} NULL")
+        )
+
+
+def _migration_0004_payments_claimed_at(conn) -> None:
+    _add_nullable_column(conn, Payment.__table__.c.claimed_at)
+
+
+def _migration_0005_payments_applied_at(conn) -> None:
+    _add_nullable_column(conn, Payment.__table__.c.applied_at)
+
+
+# (версия, описание, функция миграции) — строго по возрастанию версии
+MIGRATIONS = [
+    (1, "secondary indexes for hot query columns", _migration_0001_hot_indexes),
+    (
+        2,
+        "payments.provider and unique (provider, provider_payment_charge_id)",
+        _migration_0002_payments_provider_unique,
+    ),
+    (3, "daily revenue and user stats rollup tables", _migration_0003_rollups),
+    (
+        4,
+        "payments.claimed_at for processing lease",
+        _migration_0004_payments_claimed_at,
+    ),
+    (
+        5,
+        "payments.applied_at to never apply a payment twice",
+        _migration_0005_payments_applied_at,
+    ),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def _get_schema_version(conn) -> int:
+    """Текущая версия схемы (0 — таблицы версий ещё нет)."""
+    if not inspect(conn).has_table(SchemaVersion.__tablename__):
+        return 0
+    version = conn.execute(select(func.max(SchemaVersion.version))).scalar()
+    return version or 0
+
+
+_MISSING = object()
+
+# Алфавит и длина кода диплинка подписки
+DEEP_LINK_ALPHABET = string.ascii_lowercase + string.digits
+DEEP_LINK_LENGTH = 8
+
+# Поля users, которые update_user не откладывает в write-behind буфер:
+# их потеря при падении процесса даёт лишние права или повторный триал
+_WRITE_THROUGH_FIELDS = frozenset({"status_user", "trial"})
+
+# Через сколько занятый, но не завершённый платёж (процесс упал между
+# claim_payment и complete_payment/release_payment) может занять повтор
+PAYMENT_CLAIM_LEASE = timedelta(minutes=10)
+
+
+# Сессия текущей единицы работы (DB_M.unit_of_work), общая для всех
+# вызовов DB_M внутри одного обновления Телеграм
+_ambient_session: ContextVar[AsyncSession | None] = ContextVar(
+    "db_ambient_session", default=None
+)
+
+
+def _create_engine(db_uri, *, pool_size: int, max_overflow: int):
+    url = make_url(db_uri)
+    if url.get_backend_name() == "sqlite" and (
+        url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
+    ):
+        # In-memory SQLite живёт, пока открыто соединение: одно общее
+        # соединение на весь движок (для бенчмарков и тестов)
+        return create_async_engine(db_uri, echo=False, poolclass=StaticPool)
+
+    return create_async_engine(
+        db_uri,
+        echo=False,
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_pre_ping=True,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+    )
+
+
+def _generate_deep_link_code() -> str:
+    return "".join(secrets.choice(DEEP_LINK_ALPHABET) for _ in range(DEEP_LINK_LENGTH))
+
+
 class DB_M:
-    def __init__(self, db_uri):
+    def __init__(
+        self,
+        db_uri,
+        *,
+        user_cache_size: int = 10000,
+        user_cache_ttl: float = 60.0,
+        write_behind_interval: float = 0,
+        pool_size: int = 10,
+        max_overflow: int = 20,
+        slow_query_ms: float = 200,
+        replica_uri: str | None = None,
+        replica_lag_window: float = 5.0,
+    ):
+        """
+        :param db_uri: URL подключения к БД бота (MySQL; sqlite+aiosqlite —
+                       для локальных бенчмарков и тестов).
+        :param user_cache_size: Максимальное количество пользователей в кэше.
+        :param user_cache_ttl: Время жизни записи пользователя в кэше, секунд
+                               (0 — кэш отключён).
+        :param write_behind_interval: Интервал сброса отложенных update_user,
+                                      секунд (0 — запись сразу, без буфера).
+        :param pool_size: Количество постоянных соединений в пуле.
+        :param max_overflow: Сколько соединений сверх pool_size можно открыть
+                             под нагрузкой.
+        :param slow_query_ms: Порог логирования медленных запросов, миллисекунд
+                              (0 — не логировать).
+        :param replica_uri: URL реплики для read-only запросов
+                            (None — всё читается с основной БД).
+        :param replica_lag_window: Сколько секунд после записи читать данные
+                                   пользователя с основной БД, а не с реплики.
+        """
         if not db_uri:
             raise ValueError(
                 "SQLALCHEMY_DATABASE_URL_TG не установлен в переменных окружения"
             )
 
-        self.engine = create_async_engine(
-            db_uri, echo=False, pool_pre_ping=True, pool_size=10, max_overflow=20
+        self.engine = _create_engine(
+            db_uri, pool_size=pool_size, max_overflow=max_overflow
         )
+        self.metrics = DBMetrics(slow_query_ms=slow_query_ms)
+        self.metrics.instrument_engine("primary", self.engine)
         self.async_session = async_sessionmaker(
             self.engine, class_=AsyncSession, expire_on_commit=False
         )
 
+        # Реплика для read-only запросов со своим пулом соединений
+        if replica_uri:
+            self.replica_engine = _create_engine(
+                replica_uri, pool_size=pool_size, max_overflow=max_overflow
+            )
+            self.metrics.instrument_engine("replica", self.replica_engine)
+            self.replica_session = async_sessionmaker(
+                self.replica_engine, class_=AsyncSession, expire_on_commit=False
+            )
+        else:
+            self.replica_engine = None
+            self.replica_session = self.async_session
+        # Пользователи, записанные недавно: их читаем с основной БД, пока
+        # реплика может отставать (read-your-writes)
+        self._recent_user_writes = (
+            TTLCache(maxsize=user_cache_size, ttl=replica_lag_window)
+            if self.replica_engine is not None and replica_lag_window > 0
+            else None
+        )
+        # Read-through кэш строк таблицы users: get_user_by_id вызывается
+        # мидлварой и почти каждым хендлером на каждое обновление.
+        self.user_cache = (
+            TTLCache(maxsize=user_cache_size, ttl=user_cache_ttl)
+            if user_cache_ttl > 0
+            else None
+        )
+        # user_id -> номер записи: чтение, начатое до записи в пользователя,
+        # не должно вернуть в кэш строку, которую запись уже изменила
+        self._user_generation: dict[int, int] = {}
+        # Write-behind буфер update_user: {user_id: {поле: значение}}
+        self.write_behind_interval = write_behind_interval
+        self._pending_updates: dict[int, dict] = {}
+        self._flushing_updates: dict[int, dict] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+
+    def invalidate_user(self, user_id) -> None:
+        """
+        Сбросить закэшированную запись пользователя. Вызывается после записи
+        в users, поэтому на replica_lag_window пользователь читается с
+        основной БД.
+        """
+        self._user_written(int(user_id))
+        if self._recent_user_writes is not None:
+            self._recent_user_writes.set(int(user_id), True)
+
+        # Запись ещё не зафиксирована: после конца единицы работы сбросим
+        # кэш ещё раз, если его успели заполнить незакоммиченными данными
+        session = _ambient_session.get()
+        if session is not None:
+            session.info.setdefault("touched_users", set()).add(int(user_id))
+
+    def _user_written(self, user_id: int) -> None:
+        """Сбросить пользователя из кэша и не дать идущим чтениям вернуть его."""
+        if self.user_cache is None:
+            return
+        self.user_cache.pop(user_id)
+        self._user_generation[user_id] = self._user_generation.get(user_id, 0) + 1
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        """
+        Одна сессия (и одна транзакция) на блок: все вызовы DB_M внутри
+        используют её вместо собственных. Соединение берётся из пула только
+        при первом запросе. При выходе транзакция фиксируется, при исключении
+        откатывается. Вложенный вызов переиспользует внешнюю сессию.
+        Необратимые записи (см. _commit(durable=True)) фиксируются сразу.
+        """
+        current = _ambient_session.get()
+        if current is not None and not current.info.get("closed"):
+            yield current
+            return
+
+        async with self.async_session() as session:
+            token = _ambient_session.set(session)
+            try:
+                yield session
+                await session.commit()
+            except BaseException:
+                await session.rollback()
+                raise
+            finally:
+                _ambient_session.reset(token)
+                # Задачи, созданные внутри блока, унаследовали контекст
+                session.info["closed"] = True
+                for user_id in session.info.pop("touched_users", ()):
+                    self._user_written(user_id)
+
+    async def commit_unit_of_work(self) -> None:
+        """
+        Зафиксировать транзакцию текущей единицы работы и вернуть соединение
+        в пул; следующий запрос возьмёт его заново. Нужно перед долгими
+        операциями (рассылка), чтобы не держать соединение.
+        """
+        session = _ambient_session.get()
+        if session is not None and not session.info.get("closed"):
+            await session.commit()
+
+    @asynccontextmanager
+    async def _session(self, session: AsyncSession | None = None, factory=None):
+        """
+        Сессия для вызова DB_M: переданная явно, сессия единицы работы
+        (только для основной БД) или собственная из factory.
+        """
+        factory = factory or self.async_session
+        if session is None and factory is self.async_session:
+            session = _ambient_session.get()
+            if session is not None and session.info.get("closed"):
+                session = None
+
+        if session is not None:
+            yield session
+            return
+
+        async with factory() as session:
+            session.info["owned"] = True
+            yield session
+
+    @staticmethod
+    async def _commit(session: AsyncSession, durable: bool = False) -> None:
+        """
+        Коммит собственной сессии метода. Чужую (единица работы или явно
+        переданную) только flush'им — транзакцией управляет её владелец.
+
+        durable=True — необратимое изменение (диплинк погашен, платёж занят,
+        пользователь обновлён): сессию единицы работы тоже коммитим сразу,
+        чтобы исключение в хендлере после запроса к панели или Telegram
+        не откатило его.
+        """
+        if session.info.get("owned") or (durable and session is _ambient_session.get()):
+            await session.commit()
+        else:
+            await session.flush()
+
+    def _read_session(self, primary: bool = False, user_id=None):
+        """
+        Фабрика сессий для read-only запроса: реплика, если она настроена
+        и чтение не закреплено за основной БД (primary=True или недавняя
+        запись этого пользователя).
+        """
+        if primary:
+            return self.async_session
+        if (
+            user_id is not None
+            and self._recent_user_writes is not None
+            and self._recent_user_writes.get(int(user_id), False, count=False)
+        ):
+            return self.async_session
+        return self.replica_session
+
+    def _apply_pending_updates(self, user: UserRecord | None) -> UserRecord | None:
+        """Наложить ещё не записанные в БД изменения из write-behind буфера."""
+        if user is None:
+            return None
+        for updates in (self._flushing_updates, self._pending_updates):
+            fields = updates.get(user.user_id)
+            if fields:
+                user = user._replace(**fields)
+        return user
+
+    def start_write_behind(self) -> None:
+        """Запустить фоновый сброс write-behind буфера (если он включён)."""
+        if self.write_behind_interval <= 0 or self._flush_task is not None:
+            return
+        self._flush_task = asyncio.create_task(self._write_behind_loop())
+
+    async def _write_behind_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.write_behind_interval)
+            try:
+                # Отмена цикла (close) не должна прерывать начатый сброс
+                await asyncio.shield(self.flush_pending_updates())
+            except Exception as e:
+                logger.error(f"Ошибка сброса отложенных обновлений пользователей: {e}")
+
+    @timed
+    async def flush_pending_updates(self) -> None:
+        """
+        Записать накопленные изменения пользователей в БД.
+        Пользователи с одинаковым набором изменений обновляются одним
+        UPDATE ... WHERE user_id IN (...), всё — в одной транзакции.
+        При ошибке изменения возвращаются в буфер.
+        """
+        async with self._flush_lock:
+            if not self._pending_updates:
+                return
+
+            self._flushing_updates = self._pending_updates
+            self._pending_updates = {}
+
+            batches: dict[tuple, list[int]] = {}
+            for user_id, fields in self._flushing_updates.items():
+                batches.setdefault(tuple(sorted(fields.items())), []).append(user_id)
+
+            try:
+                async with self.async_session() as session:
+                    for fields, user_ids in batches.items():
+                        await session.execute(
+                            update(User)
+                            .where(User.user_id.in_(user_ids))
+                            .values(**dict(fields))
+                            .execution_options(synchronize_session=False)
+                        )
+                    await session.commit()
+            except BaseException:
+                # Более новые изменения из буфера важнее возвращаемых
+                for user_id, fields in self._flushing_updates.items():
+                    self._pending_updates[user_id] = {
+                        **fields,
+                        **self._pending_updates.get(user_id, {}),
+                    }
+                raise
+            else:
+                for user_id in self._flushing_updates:
+                    self.invalidate_user(user_id)
+            finally:
+                self._flushing_updates = {}
+
+    async def close(self) -> None:
+        """Остановить фоновые задачи, сбросить буфер и закрыть пул соединений."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        # Дожидается начатого фоновым циклом сброса (_flush_lock)
+        await self.flush_pending_updates()
+        await self.engine.dispose()
+        if self.replica_engine is not None:
+            await self.replica_engine.dispose()
+
+    def user_cache_stats(self) -> dict:
+        """Счётчики попаданий/промахов кэша пользователей."""
+        if self.user_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.user_cache.stats()}
+
+    def db_stats(self) -> dict:
+        """
+        Метрики слоя БД для мониторинга и подбора размера пула: состояние пула
+        и время checkout, задержки запросов и методов DB_M, медленные запросы, кэш.
+        """
+        return {
+            **self.metrics.snapshot(),
+            "user_cache": self.user_cache_stats(),
+            "pending_updates": len(self._pending_updates),
+        }
+
+    @timed
     async def create_tables(self):
+        """
+        Создаёт таблицы и применяет недостающие миграции схемы.
+        Если схема уже актуальна, create_all (рефлексия всех таблиц) пропускается.
+        """
         async with self.engine.begin() as conn:
+            current_version = await conn.run_sync(_get_schema_version)
+            if current_version >= SCHEMA_VERSION:
+                return
+
             await conn.run_sync(Base.metadata.create_all)
 
+            for version, description, migration in MIGRATIONS:
+                if version <= current_version:
+                    continue
+
+                logger.info(f"Применяем миграцию схемы БД {version}: {description}")
+                await conn.run_sync(migration)
+                await conn.execute(
+                    insert(SchemaVersion).values(
+                        version=version, description=description
+                    )
+                )
+
+    @timed
     async def add_new_user(
         self,
         user_id,
@@ -107,49 +795,135 @@ class DB_M:
         language="ru",
         trial="true",
         rules_accepted=False,
+        *,
+        session: AsyncSession | None = None,
     ):
-        async with self.async_session() as session:
-            # Проверяем, существует ли пользователь
-            result = await session.execute(select(User).where(User.user_id == user_id))
-            existing_user = result.scalar_one_or_none()
+        """
+        Добавляет пользователя одним атомарным upsert'ом
+        (INSERT ... ON DUPLICATE KEY UPDATE; на SQLite — INSERT OR IGNORE
+        и UPDATE).
+        Если пользователь уже есть — обновляет username, first_name и last_name,
+        остальные поля (язык, статус, trial, правила) не трогает.
+        Новая регистрация учитывается в daily_user_stats в той же транзакции.
+        """
+        values = dict(
+            user_id=user_id,
+            username=username,
+            first_name=first_name,
+            last_name=last_name,
+            language=language,
+            trial=trial,
+            rules_accepted=rules_accepted,
+        )
+        dialect_name = self.engine.dialect.name
 
-            if existing_user is None:
-                # Пользователь не существует, создаем нового
-                new_user = User(
-                    user_id=user_id,
-                    username=username,
-                    first_name=first_name,
-                    last_name=last_name,
-                    language=language,
-                    trial="true",
-                    rules_accepted=rules_accepted,
+        async with self._session(session) as session:
+            if dialect_name == "mysql":
+                # У users нет AUTO_INCREMENT, поэтому при вставке lastrowid = 0;
+                # при дубле LAST_INSERT_ID(user_id) вернёт ненулевой id. rowcount
+                # тут не подходит: с CLIENT_FOUND_ROWS вставка и «без изменений»
+                # дают 1.
+                stmt = mysql_insert(User).values(**values)
+                stmt = stmt.on_duplicate_key_update(
+                    user_id=func.last_insert_id(User.user_id),
+                    username=stmt.inserted.username,
+                    first_name=stmt.inserted.first_name,
+                    last_name=stmt.inserted.last_name,
                 )
-                session.add(new_user)
-                await session.commit()
+                result = await session.execute(stmt)
+                inserted = result.lastrowid == 0
+            else:
+                # SQLite: вставка без перезаписи, затем обновление имён
+                result = await session.execute(
+                    _insert_ignore_stmt(User).values(**values)
+                )
+                inserted = result.rowcount == 1
+                if not inserted:
+                    await session.execute(
+                        update(User)
+                        .where(User.user_id == user_id)
+                        .values(
+                            username=username,
+                            first_name=first_name,
+                            last_name=last_name,
+                        )
+                    )
 
-    async def get_user_by_id(self, user_id):
-        async with self.async_session() as session:
-            result = await session.execute(select(User).where(User.user_id == user_id))
-            user = result.scalar_one_or_none()
+            if inserted:
+                await session.execute(
+                    _increment_stmt(
+                        dialect_name,
+                        DailyUserStats,
+                        {"day": func.current_date()},
+                        {"signups": 1},
+                    )
+                )
+            await self._commit(session)
 
-            if user is None:
-                return None
+        self.invalidate_user(user_id)
+
+    @timed
+    async def get_user_by_id(
+        self,
+        user_id,
+        *,
+        primary: bool = False,
+        session: AsyncSession | None = None,
+    ) -> UserRecord | None:
+        """
+        :param primary: Прочитать с основной БД в обход кэша и реплики
+                        (например, сразу после записи).
+        """
+        if self.user_cache is not None and not primary:
+            cached = self.user_cache.get(int(user_id), _MISSING)
+            if cached is not _MISSING:
+                return self._apply_pending_updates(cached)
+
+        generation = self._user_generation.get(int(user_id), 0)
+        user = await self._fetch_user_by_id(user_id, primary=primary, session=session)
 
-            # Возвращаем в формате кортежа для совместимости: (user_id, username, first_name, last_name, reg_time, status_user, language, trial, rules_accepted)
-            return (
-                user.user_id,
-                user.username,
-                user.first_name,
-                user.last_name,
-                user.reg_time,
-                user.status_user,
-                user.language,
-                user.trial,
-                user.rules_accepted,
+        # Кэшируем и отсутствие пользователя: add_new_user сбросит запись.
+        # Если пользователя записали, пока шло чтение, строка могла устареть
+        if (
+            self.user_cache is not None
+            and self._user_generation.get(int(user_id), 0) == generation
+        ):
+            self.user_cache.set(int(user_id), user)
+        return self._apply_pending_updates(user)
+
+    @timed
+    async def _fetch_user_by_id(
+        self,
+        user_id,
+        *,
+        primary: bool = False,
+        session: AsyncSession | None = None,
+    ) -> UserRecord | None:
+        async with self._session(
+            session, self._read_session(primary, user_id)
+        ) as session:
+            result = await session.execute(
+                select(*_USER_RECORD_COLUMNS).where(User.user_id == user_id)
             )
+            row = result.one_or_none()
+            return UserRecord._make(row) if row is not None else None
 
-    async def get_status_user(self, user_id):
-        async with self.async_session() as session:
+    @timed
+    async def get_status_user(
+        self,
+        user_id,
+        *,
+        primary: bool = False,
+        session: AsyncSession | None = None,
+    ):
+        if self.user_cache is not None and not primary:
+            cached = self.user_cache.get(int(user_id), _MISSING)
+            if cached is not _MISSING:
+                return (cached.status_user if cached else "user",)
+
+        async with self._session(
+            session, self._read_session(primary, user_id)
+        ) as session:
             result = await session.execute(
                 select(User.status_user).where(User.user_id == user_id)
             )
@@ -162,64 +936,91 @@ class DB_M:
             # Возвращаем в формате кортежа для совместимости: (status_user,)
             return (status_user,)
 
-    async def get_admins(self):
-        async with self.async_session() as session:
+    @timed
+    async def get_admins(
+        self, *, session: AsyncSession | None = None
+    ) -> list[UserRecord]:
+        async with self._session(session) as session:
             result = await session.execute(
-                select(User).where(
-                    (User.status_user == "main_admin") | (User.status_user == "admin")
+                select(*_USER_RECORD_COLUMNS).where(
+                    User.status_user.in_(("main_admin", "admin"))
                 )
             )
-            admins = result.scalars().all()
-
-            # Возвращаем список кортежей для совместимости
-            return [
-                (
-                    admin.user_id,
-                    admin.username,
-                    admin.first_name,
-                    admin.last_name,
-                    admin.reg_time,
-                    admin.status_user,
-                    admin.language,
-                    admin.trial,
-                )
-                for admin in admins
-            ]
+            return [UserRecord._make(row) for row in result]
 
+    @timed
     async def create_deep_link(self, duration_days: int) -> str:
         """
         Генерирует уникальный deep_link и сохраняет запись в БД.
         Возвращает строку deep_link (payload).
         """
-        while True:
-            # Генерируем случайную строку длиной 8 символов
-            deep_link = "".join(
-                random.choices(string.ascii_lowercase + string.digits, k=8)
-            )
-            # Проверяем уникальность
-            async with self.async_session() as session:
-                result = await session.execute(
-                    select(DeepLink).where(DeepLink.deep_link == deep_link)
+        deep_links = await self.create_deep_links_bulk(duration_days, 1)
+        return deep_links[0]
+
+    @timed
+    async def create_deep_links_bulk(
+        self,
+        duration_days: int,
+        count: int,
+        *,
+        batch_size: int = 1000,
+        max_attempts: int = 5,
+    ) -> list[str]:
+        """
+        Генерирует count уникальных диплинков на duration_days дней.
+
+        Коды генерируются через secrets и вставляются многострочным INSERT
+        (по batch_size строк за запрос) без предварительных SELECT'ов:
+        уникальность проверяет уникальный индекс deep_links.deep_link.
+        При коллизии батч откатывается и вставляется заново с новыми кодами.
+        Возвращает список созданных deep_link (payload).
+        """
+        created: list[str] = []
+
+        while len(created) < count:
+            size = min(batch_size, count - len(created))
+
+            for attempt in range(1, max_attempts + 1):
+                codes: dict[str, None] = {}
+                while len(codes) < size:
+                    codes[_generate_deep_link_code()] = None
+
+                stmt = insert(DeepLink).values(
+                    [
+                        {
+                            "deep_link": code,
+                            "duration_days": duration_days,
+                            "is_active": True,
+                        }
+                        for code in codes
+                    ]
                 )
-                existing = result.scalar_one_or_none()
-                if existing is None:
-                    break
+                try:
+                    async with self.async_session() as session:
+                        await session.execute(stmt)
+                        await session.commit()
+                except IntegrityError:
+                    if attempt == max_attempts:
+                        raise
+                    logger.warning(
+                        f"Коллизия кодов диплинков, повторяем батч (попытка {attempt})"
+                    )
+                    continue
 
-        async with self.async_session() as session:
-            new_deep_link = DeepLink(
-                deep_link=deep_link, duration_days=duration_days, is_active=True
-            )
-            session.add(new_deep_link)
-            await session.commit()
+                created.extend(codes)
+                break
 
-        return deep_link
+        return created
 
-    async def get_deep_link(self, deep_link: str):
+    @timed
+    async def get_deep_link(
+        self, deep_link: str, *, session: AsyncSession | None = None
+    ):
         """
         Возвращает диплинк подписки.
         Если диплинк не найден или не активен, возвращает None.
         """
-        async with self.async_session() as session:
+        async with self._session(session) as session:
             result = await session.execute(
                 select(DeepLink).where(DeepLink.deep_link == deep_link)
             )
@@ -228,71 +1029,163 @@ class DB_M:
                 return None
             return record
 
-    async def activate_deep_link(self, deep_link: str, user_id: int) -> bool:
+    @timed
+    async def activate_deep_link(
+        self, deep_link: str, user_id: int, *, session: AsyncSession | None = None
+    ) -> int | None:
         """
-        Активирует диплинк, помечая его использованным и записывая user_id.
-        Возвращает True в случае успеха, False если диплинк не найден или уже использован.
+        Атомарно активирует диплинк одним условным
+        UPDATE ... WHERE deep_link=? AND is_active=1, помечая его использованным
+        и записывая user_id. Успех определяется по rowcount, поэтому один диплинк
+        нельзя активировать дважды даже при одновременных запросах.
+        Возвращает duration_days в случае успеха, None если диплинк не найден
+        или уже использован.
         """
-        async with self.async_session() as session:
-            result = await session.execute(
-                select(DeepLink).where(DeepLink.deep_link == deep_link)
+        stmt = (
+            update(DeepLink)
+            .where((DeepLink.deep_link == deep_link) & DeepLink.is_active.is_(True))
+            .values(
+                is_active=False,
+                activated_at=func.now(),
+                activated_by_user_id=user_id,
             )
-            record = result.scalar_one_or_none()
-            if record is None or not record.is_active:
-                return False
-
-            # Обновляем запись
-            stmt = (
-                update(DeepLink)
-                .where(DeepLink.id == record.id)
-                .values(
-                    is_active=False,
-                    activated_at=func.now(),
-                    activated_by_user_id=user_id,
+            .execution_options(synchronize_session=False)
+        )
+
+        async with self._session(session) as session:
+            if self.engine.dialect.update_returning:
+                result = await session.execute(stmt.returning(DeepLink.duration_days))
+                duration_days = result.scalar_one_or_none()
+            else:
+                # MySQL не поддерживает UPDATE ... RETURNING: присваивание
+                # duration_days = LAST_INSERT_ID(duration_days) не меняет значение,
+                # но возвращает его в ответе сервера (lastrowid) без отдельного SELECT
+                result = await session.execute(
+                    stmt.values(
+                        duration_days=func.last_insert_id(DeepLink.duration_days)
+                    )
                 )
-            )
-            await session.execute(stmt)
-            await session.commit()
-            return True
+                duration_days = result.lastrowid if result.rowcount == 1 else None
+            await self._commit(session, durable=True)
+
+        return duration_days
 
-    async def list_deep_links(self):
+    @timed
+    async def list_deep_links(
+        self, *, primary: bool = False, session: AsyncSession | None = None
+    ):
         """
         Возвращает список всех диплинков.
         """
-        async with self.async_session() as session:
+        async with self._session(session, self._read_session(primary)) as session:
             result = await session.execute(
                 select(DeepLink).order_by(DeepLink.created_at.desc())
             )
             records = result.scalars().all()
             return records
 
-    async def update_user(self, user_id, **kwargs) -> None:
+    async def iter_deep_links(self, chunk_size: int = 500, *, primary: bool = False):
+        """
+        Асинхронный генератор по всем диплинкам (от новых к старым) порциями
+        по chunk_size записей. Использует keyset-пагинацию по id и серверный
+        курсор, поэтому таблица целиком в память не загружается.
+        """
+        last_id = None
+        while True:
+            stmt = select(DeepLink).order_by(DeepLink.id.desc()).limit(chunk_size)
+            if last_id is not None:
+                stmt = stmt.where(DeepLink.id < last_id)
+
+            async with self._read_session(primary)() as session:
+                result = await session.stream_scalars(stmt)
+                chunk = [record async for record in result]
+
+            if not chunk:
+                return
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            last_id = chunk[-1].id
+
+    @timed
+    async def update_user(
+        self, user_id, *, session: AsyncSession | None = None, **kwargs
+    ) -> None:
         """
         Обновляет данные пользователя.
+
+        Если включён write-behind (write_behind_interval > 0), изменения
+        копятся в буфере и объединяются по user_id до фонового сброса;
+        get_user_by_id видит их сразу. Поля из _WRITE_THROUGH_FIELDS
+        (права доступа, использованный пробный период) всегда пишутся
+        немедленно вместе с накопленными изменениями.
         """
         if not kwargs:
             return
 
-        async with self.async_session() as session:
+        if self.write_behind_interval > 0:
+            user_id = int(user_id)
+            if _WRITE_THROUGH_FIELDS.isdisjoint(kwargs):
+                self._pending_updates.setdefault(user_id, {}).update(kwargs)
+                return
+            kwargs = {**self._pending_updates.pop(user_id, {}), **kwargs}
+
+        async with self._session(session) as session:
             stmt = update(User).where(User.user_id == user_id).values(**kwargs)
             await session.execute(stmt)
-            await session.commit()
+            await self._commit(session, durable=True)
 
-    async def count_users(self) -> int:
-        async with self.async_session() as session:
+        self.invalidate_user(user_id)
+
+    @timed
+    async def count_users(
+        self, *, primary: bool = False, session: AsyncSession | None = None
+    ) -> int:
+        async with self._session(session, self._read_session(primary)) as session:
             result = await session.execute(select(func.count(User.user_id)))
             count = result.scalar()
 
             return count
 
-    async def get_users_id(self) -> list:
-        async with self.async_session() as session:
+    @timed
+    async def get_users_id(
+        self, *, primary: bool = False, session: AsyncSession | None = None
+    ) -> list:
+        async with self._session(session, self._read_session(primary)) as session:
             result = await session.execute(select(User.user_id))
             users_id = result.scalars().all()
 
             # Возвращаем список кортежей для совместимости: [(user_id,), ...]
             return [(user_id,) for user_id in users_id]
 
+    async def iter_users_id(self, chunk_size: int = 1000, *, primary: bool = False):
+        """
+        Асинхронный генератор user_id всех пользователей порциями
+        (списками) по chunk_size штук, в порядке возрастания user_id.
+
+        Каждая порция читается отдельной короткой сессией через серверный
+        курсор с keyset-пагинацией (WHERE user_id > последний), поэтому
+        долгая рассылка не держит соединение из пула, а память не растёт
+        с количеством пользователей.
+        """
+        last_id = None
+        while True:
+            stmt = select(User.user_id).order_by(User.user_id).limit(chunk_size)
+            if last_id is not None:
+                stmt = stmt.where(User.user_id > last_id)
+
+            async with self._read_session(primary)() as session:
+                result = await session.stream_scalars(stmt)
+                chunk = [user_id async for user_id in result]
+
+            if not chunk:
+                return
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            last_id = chunk[-1]
+
+    @timed
     async def add_payment(
         self,
         user_id,
@@ -302,22 +1195,231 @@ class DB_M:
         telegram_payment_charge_id,
         provider_payment_charge_id=None,
         status="completed",
-    ):
-        async with self.async_session() as session:
-            new_payment = Payment(
-                user_id=user_id,
-                amount=amount,
-                currency=currency,
-                payload=payload,
-                telegram_payment_charge_id=telegram_payment_charge_id,
-                provider_payment_charge_id=provider_payment_charge_id,
-                status=status,
+        *,
+        provider: str = "yookassa",
+        session: AsyncSession | None = None,
+    ) -> bool:
+        """
+        Записывает платёж одним INSERT IGNORE: повтор того же
+        (provider, provider_payment_charge_id) отсекается уникальным индексом.
+        Возвращает True если платёж новый, False если он уже записан.
+
+        Для обработки с побочными эффектами (продление подписки) платёж
+        занимается через claim_payment.
+        """
+        stmt = _insert_ignore_stmt(Payment).values(
+            user_id=user_id,
+            provider=provider,
+            amount=amount,
+            currency=currency,
+            payload=payload,
+            telegram_payment_charge_id=telegram_payment_charge_id,
+            provider_payment_charge_id=provider_payment_charge_id,
+            status=status,
+        )
+
+        async with self._session(session) as session:
+            result = await session.execute(stmt)
+            inserted = result.rowcount == 1
+            if inserted and status == "completed":
+                await self._record_completed_payment(session, user_id, amount, currency)
+            await self._commit(session, durable=True)
+            return inserted
+
+    @timed
+    async def claim_payment(
+        self,
+        user_id,
+        amount,
+        currency,
+        payload,
+        telegram_payment_charge_id,
+        provider_payment_charge_id,
+        *,
+        provider: str = "yookassa",
+        lease: timedelta = PAYMENT_CLAIM_LEASE,
+        session: AsyncSession | None = None,
+    ) -> str:
+        """
+        Занимает платёж для обработки с побочными эффектами (продление
+        подписки): INSERT IGNORE со status="processing". Перед побочными
+        эффектами вызывается mark_payment_applying, после них платёж
+        подтверждается complete_payment или освобождается release_payment.
+
+        Занятый дольше lease платёж (обработчик упал, не завершив его)
+        перезанимается условным UPDATE по claimed_at — из одновременных
+        повторов это удаётся только одному.
+
+        Возвращает "claimed" (платёж наш), "applied" (перезанят, но прошлый
+        обработчик уже начал его применять — только подтвердить),
+        "in_progress" (его обрабатывают сейчас — повторить позже) или
+        "done" (уже обработан).
+        """
+        payment_key = (Payment.provider == provider) & (
+            Payment.provider_payment_charge_id == provider_payment_charge_id
+        )
+        async with self._session(session) as session:
+            result = await session.execute(
+                _insert_ignore_stmt(Payment).values(
+                    user_id=user_id,
+                    provider=provider,
+                    amount=amount,
+                    currency=currency,
+                    payload=payload,
+                    telegram_payment_charge_id=telegram_payment_charge_id,
+                    provider_payment_charge_id=provider_payment_charge_id,
+                    status="processing",
+                    claimed_at=func.now(),
+                )
             )
-            session.add(new_payment)
-            await session.commit()
+            if result.rowcount == 1:
+                await self._commit(session, durable=True)
+                return "claimed"
 
-    async def get_payments_by_user(self, user_id):
-        async with self.async_session() as session:
+            result = await session.execute(
+                update(Payment)
+                .where(
+                    payment_key
+                    & (Payment.status == "processing")
+                    & (
+                        Payment.claimed_at.is_(None)
+                        | (
+                            Payment.claimed_at
+                            < _db_now_minus(
+                                self.engine.dialect.name, lease.total_seconds()
+                            )
+                        )
+                    )
+                )
+                .values(claimed_at=func.now())
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                applied_at = await session.scalar(
+                    select(Payment.applied_at).where(payment_key)
+                )
+                await self._commit(session, durable=True)
+                logger.warning(
+                    f"Платёж {provider}:{provider_payment_charge_id} занят "
+                    f"дольше {lease}, перезанимаем"
+                )
+                return "claimed" if applied_at is None else "applied"
+
+            status = await session.scalar(select(Payment.status).where(payment_key))
+            await self._commit(session)
+            return "done" if status == "completed" else "in_progress"
+
+    @timed
+    async def mark_payment_applying(
+        self,
+        provider_payment_charge_id: str,
+        *,
+        provider: str = "yookassa",
+        session: AsyncSession | None = None,
+    ) -> None:
+        """
+        Отмечает занятый платёж как применяемый — до побочных эффектов, чтобы
+        после истечения аренды повтор их не повторил (см. claim_payment).
+        """
+        async with self._session(session) as session:
+            await session.execute(
+                update(Payment)
+                .where(
+                    (Payment.provider == provider)
+                    & (Payment.provider_payment_charge_id == provider_payment_charge_id)
+                    & (Payment.status == "processing")
+                )
+                .values(applied_at=func.now())
+                .execution_options(synchronize_session=False)
+            )
+            await self._commit(session, durable=True)
+
+    async def _record_completed_payment(
+        self, session: AsyncSession, user_id, amount, currency
+    ) -> None:
+        """Учесть завершённый платёж в сводных таблицах (та же транзакция)."""
+        await session.execute(
+            _increment_stmt(
+                self.engine.dialect.name,
+                DailyRevenue,
+                {"day": func.current_date(), "currency": currency},
+                {"payments_count": 1, "amount_total": int(amount)},
+            )
+        )
+
+        # Первый завершённый платёж пользователя — конверсия в платящего
+        completed_count = await session.scalar(
+            select(func.count())
+            .select_from(Payment)
+            .where((Payment.user_id == user_id) & (Payment.status == "completed"))
+        )
+        if completed_count == 1:
+            await session.execute(
+                _increment_stmt(
+                    self.engine.dialect.name,
+                    DailyUserStats,
+                    {"day": func.current_date()},
+                    {"first_payments": 1},
+                )
+            )
+
+    @timed
+    async def complete_payment(
+        self,
+        provider_payment_charge_id: str,
+        *,
+        provider: str = "yookassa",
+        session: AsyncSession | None = None,
+    ) -> None:
+        """Подтверждает занятый платёж (status="completed")."""
+        payment_key = (Payment.provider == provider) & (
+            Payment.provider_payment_charge_id == provider_payment_charge_id
+        )
+        async with self._session(session) as session:
+            result = await session.execute(
+                update(Payment)
+                .where(payment_key & (Payment.status == "processing"))
+                .values(status="completed")
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                payment = (
+                    await session.execute(
+                        select(Payment.user_id, Payment.amount, Payment.currency).where(
+                            payment_key
+                        )
+                    )
+                ).one()
+                await self._record_completed_payment(session, *payment)
+            await self._commit(session, durable=True)
+
+    @timed
+    async def release_payment(
+        self,
+        provider_payment_charge_id: str,
+        *,
+        provider: str = "yookassa",
+        session: AsyncSession | None = None,
+    ) -> None:
+        """
+        Освобождает занятый, но не применённый платёж, чтобы повтор
+        вебхука смог обработать его заново.
+        """
+        async with self._session(session) as session:
+            await session.execute(
+                delete(Payment).where(
+                    (Payment.provider == provider)
+                    & (Payment.provider_payment_charge_id == provider_payment_charge_id)
+                    & (Payment.status == "processing")
+                )
+            )
+            await self._commit(session, durable=True)
+
+    @timed
+    async def get_payments_by_user(
+        self, user_id, *, primary: bool = False, session: AsyncSession | None = None
+    ):
+        async with self._session(session, self._read_session(primary)) as session:
             result = await session.execute(
                 select(Payment)
                 .where(Payment.user_id == user_id)
@@ -330,6 +1432,7 @@ class DB_M:
                 {
                     "id": p.id,
                     "user_id": p.user_id,
+                    "provider": p.provider,
                     "amount": p.amount,
                     "currency": p.currency,
                     "payload": p.payload,
@@ -341,6 +1444,51 @@ class DB_M:
                 for p in payments
             ]
 
+    @timed
+    async def get_rollup_report(self, days: int = 30, *, primary: bool = False) -> dict:
+        """
+        Отчёт за последние days дней из сводных таблиц (O(дней) строк):
+        {"users": [(day, signups, first_payments), ...],
+         "revenue": [(day, currency, payments_count, amount_total), ...]}
+        от новых дней к старым. "Сегодня" — по часам БД, как и при записи.
+        """
+        since = _db_days_ago(self.engine.dialect.name, days - 1)
+        async with self._session(None, self._read_session(primary)) as session:
+            users = await session.execute(
+                select(
+                    DailyUserStats.day,
+                    DailyUserStats.signups,
+                    DailyUserStats.first_payments,
+                )
+                .where(DailyUserStats.day >= since)
+                .order_by(DailyUserStats.day.desc())
+            )
+            revenue = await session.execute(
+                select(
+                    DailyRevenue.day,
+                    DailyRevenue.currency,
+                    DailyRevenue.payments_count,
+                    DailyRevenue.amount_total,
+                )
+                .where(DailyRevenue.day >= since)
+                .order_by(DailyRevenue.day.desc(), DailyRevenue.currency)
+            )
+            return {
+                "users": [tuple(row) for row in users],
+                "revenue": [tuple(row) for row in revenue],
+            }
+
+    @timed
+    async def rebuild_rollups(self) -> int:
+        """
+        Пересчитать сводные таблицы из payments и users одной транзакцией.
+        Платежи и регистрации, пришедшие во время пересчёта, могут учесться
+        неточно — запускать в спокойное время. Возвращает количество дней.
+        """
+        async with self.engine.begin() as conn:
+            return await conn.run_sync(_rebuild_rollups)
+
+    @timed
     async def register_pasarguard_notification_event(
         self,
         *,
@@ -348,29 +1496,64 @@ class DB_M:
         user_id: int,
         days_left: int,
         source: str = "pasarguard",
+        session: AsyncSession | None = None,
     ) -> bool:
         """
-        Регистрирует событие уведомления.
+        Регистрирует событие уведомления одним INSERT IGNORE:
+        дубль отсекается уникальным индексом (source, event_id).
         Возвращает True если событие новое (будем слать сообщение),
         False если уже было (дубль — игнорируем).
         """
-        async with self.async_session() as session:
-            exists = await session.execute(
-                select(PasarguardNotificationEvent.id).where(
-                    (PasarguardNotificationEvent.source == source)
-                    & (PasarguardNotificationEvent.event_id == event_id)
+        stmt = _insert_ignore_stmt(PasarguardNotificationEvent).values(
+            source=source,
+            event_id=event_id,
+            user_id=user_id,
+            days_left=int(days_left),
+        )
+
+        async with self._session(session) as session:
+            result = await session.execute(stmt)
+            await self._commit(session, durable=True)
+            return result.rowcount == 1
+
+    @timed
+    async def prune_pasarguard_notification_events(
+        self, older_than: timedelta, *, batch_size: int = 1000
+    ) -> int:
+        """
+        Удаляет события уведомлений старше older_than порциями по batch_size
+        строк (каждая порция — отдельная короткая транзакция), чтобы индекс
+        дедупликации оставался небольшим и не блокировать таблицу надолго.
+        Возвращает количество удалённых записей.
+        """
+        # received_at ставит CURRENT_TIMESTAMP сервера БД — границу считаем
+        # по тем же часам, а не по часовому поясу процесса
+        cutoff = _db_now_minus(self.engine.dialect.name, older_than.total_seconds())
+        deleted = 0
+
+        while True:
+            async with self.async_session() as session:
+                result = await session.execute(
+                    select(PasarguardNotificationEvent.id)
+                    .where(PasarguardNotificationEvent.received_at < cutoff)
+                    .order_by(PasarguardNotificationEvent.id)
+                    .limit(batch_size)
                 )
-            )
-            if exists.scalar_one_or_none() is not None:
-                return False
+                ids = result.scalars().all()
+                if not ids:
+                    break
 
-            session.add(
-                PasarguardNotificationEvent(
-                    source=source,
-                    event_id=event_id,
-                    user_id=user_id,
-                    days_left=int(days_left),
+                await session.execute(
+                    delete(PasarguardNotificationEvent).where(
+                        PasarguardNotificationEvent.id.in_(ids)
+                    )
                 )
-            )
-            await session.commit()
-            return True
+                await session.commit()
+
+            deleted += len(ids)
+            if len(ids) < batch_size:
+                break
+            # Отдаём управление циклу событий между порциями
+            await asyncio.sleep(0)
+
+        return deleted
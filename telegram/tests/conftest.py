@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Модули бота импортируются как top-level (так их запускает main.py)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
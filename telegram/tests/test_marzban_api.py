@@ -0,0 +1,52 @@
+import asyncio
+import json
+
+import aiohttp
+import pytest
+
+from utils.marzban_api import MarzbanAPIClient, MarzbanUnavailableError
+from utils.resilience import CircuitBreaker, RetryPolicy
+
+
+def _client(**kwargs) -> MarzbanAPIClient:
+    return MarzbanAPIClient(
+        base_url="http://panel.test",
+        admin_username="admin",
+        admin_password="secret",
+        **kwargs,
+    )
+
+
+def test_breaker_recovers_after_unexpected_probe_error():
+    async def scenario():
+        client = _client(
+            retry_policy=RetryPolicy(attempts=1),
+            circuit_breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.05),
+        )
+        errors = [
+            aiohttp.ClientConnectionError("refused"),
+            # HTML-страница 502 от прокси вместо JSON
+            json.JSONDecodeError("Expecting value", "<html>", 0),
+        ]
+
+        async def send_once(*args):
+            if errors:
+                raise errors.pop(0)
+            return {"ok": True}
+
+        client._send_once = send_once
+
+        with pytest.raises(MarzbanUnavailableError):
+            await client._request("GET", "/api/system")
+        assert client.breaker_state == CircuitBreaker.OPEN
+
+        await asyncio.sleep(0.06)
+        with pytest.raises(json.JSONDecodeError):
+            await client._request("GET", "/api/system")
+        assert client.breaker_state == CircuitBreaker.OPEN
+
+        await asyncio.sleep(0.06)
+        assert await client._request("GET", "/api/system") == {"ok": True}
+        assert client.breaker_state == CircuitBreaker.CLOSED
+
+    asyncio.run(scenario())
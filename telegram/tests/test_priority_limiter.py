@@ -0,0 +1,23 @@
+import asyncio
+
+from utils.priority_limiter import PriorityLimiter
+
+
+def test_cancelled_head_waiter_does_not_block_waiters_behind_it():
+    async def scenario():
+        limiter = PriorityLimiter(4, ("interactive", "background"))
+        await limiter.acquire("interactive", 2)
+
+        # Голова очереди ждёт 4 единицы — свободных 2, очередь стоит
+        head = asyncio.create_task(limiter.acquire("interactive", 4))
+        behind = asyncio.create_task(limiter.acquire("background", 1))
+        await asyncio.sleep(0)
+        assert not head.done() and not behind.done()
+
+        head.cancel()
+        await asyncio.wait_for(behind, timeout=1)
+        stats = limiter.stats()
+        assert stats["in_use"] == 3
+        assert stats["classes"]["interactive"]["queued"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,112 @@
+import asyncio
+from sqlalchemy import text
+
+from storage import DB_M
+
+
+def _run(scenario, **kwargs):
+    async def main():
+        db = DB_M("sqlite+aiosqlite:///:memory:", **kwargs)
+        try:
+            await db.create_tables()
+            await scenario(db)
+        finally:
+            # Иначе поток aiosqlite не даст процессу завершиться
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_read_racing_a_write_does_not_cache_stale_user():
+    async def scenario(db: DB_M):
+        await db.add_new_user(1, "user", "First", "Last", language="ru")
+
+        fetch = db._fetch_user_by_id
+        fetched = asyncio.Event()
+        write_done = asyncio.Event()
+
+        async def slow_fetch(*args, **kwargs):
+            user = await fetch(*args, **kwargs)
+            # Строка прочитана до записи, но в кэш попадёт после неё
+            fetched.set()
+            await write_done.wait()
+            return user
+
+        db._fetch_user_by_id = slow_fetch
+        read = asyncio.create_task(db.get_user_by_id(1))
+        await fetched.wait()
+        await db.update_user(1, language="en")
+        write_done.set()
+        assert (await read).language == "ru"
+
+        db._fetch_user_by_id = fetch
+        assert (await db.get_user_by_id(1)).language == "en"
+
+    _run(scenario, user_cache_ttl=60)
+
+
+async def _expire_claims(db: DB_M) -> None:
+    """Сдвинуть claimed_at всех платежей за пределы аренды."""
+    async with db.async_session() as session:
+        await session.execute(
+            text("UPDATE payments SET claimed_at = datetime('now', '-1 day')")
+        )
+        await session.commit()
+
+
+def test_expired_claim_is_not_applied_twice():
+    async def scenario(db: DB_M):
+        payment = dict(
+            user_id=1,
+            amount=10000,
+            currency="RUB",
+            payload="one_month",
+            telegram_payment_charge_id="",
+            provider_payment_charge_id="pay-1",
+        )
+        assert await db.claim_payment(**payment) == "claimed"
+        assert await db.claim_payment(**payment) == "in_progress"
+
+        # Обработчик начал продление и упал, аренда истекла
+        await db.mark_payment_applying("pay-1")
+        await _expire_claims(db)
+        assert await db.claim_payment(**payment) == "applied"
+
+        await db.complete_payment("pay-1")
+        assert await db.claim_payment(**payment) == "done"
+
+    _run(scenario)
+
+
+def test_expired_claim_before_applying_is_taken_over():
+    async def scenario(db: DB_M):
+        payment = dict(
+            user_id=1,
+            amount=10000,
+            currency="RUB",
+            payload="one_month",
+            telegram_payment_charge_id="",
+            provider_payment_charge_id="pay-2",
+        )
+        assert await db.claim_payment(**payment) == "claimed"
+        await _expire_claims(db)
+        assert await db.claim_payment(**payment) == "claimed"
+        assert await db.claim_payment(**payment) == "in_progress"
+
+    _run(scenario)
+
+
+def test_cache_hits_are_not_recorded_as_db_latency():
+    async def scenario(db: DB_M):
+        await db.add_new_user(1, "user", "First", "Last")
+        await db.get_user_by_id(1)
+        for _ in range(5):
+            await db.get_user_by_id(1)
+
+        stats = db.db_stats()
+        assert stats["methods"]["get_user_by_id"]["count"] == 1
+        assert stats["methods"]["_fetch_user_by_id"]["count"] == 1
+        assert stats["methods_without_queries"]["get_user_by_id"] == 5
+        assert stats["queries"]["latency_ms"]["count"] == stats["queries"]["total"]
+
+    _run(scenario, user_cache_ttl=60)
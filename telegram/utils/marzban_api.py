@@ -1,5 +1,12 @@
 import asyncio
-from typing import Any, Dict, List, Optional
+import base64
+import functools
+import json as jsonlib
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
 
 import aiohttp
 from aiohttp import ClientResponse
@@ -26,6 +33,37 @@ from models.node import (
     NodesResponse,
 )
 from models.system import SystemStats
+from db_metrics import LatencyHistogram
+from utils.priority_limiter import PriorityLimiter
+from utils.resilience import CircuitBreaker, RetryPolicy
+from utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# За сколько секунд до истечения JWT администратора получать новый токен
+TOKEN_REFRESH_MARGIN = 60
+# Методы, которые безопасно повторять после сбоя соединения
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE"})
+# Ответы прокси/панели, означающие недоступность, а не ошибку запроса
+UNAVAILABLE_STATUSES = frozenset({502, 503, 504})
+# Классы запросов к панели по убыванию приоритета
+REQUEST_PRIORITIES = ("interactive", "webhook", "background")
+
+# Класс запросов текущей задачи (см. MarzbanAPIClient.priority)
+_request_priority: ContextVar[str] = ContextVar(
+    "marzban_request_priority", default="interactive"
+)
+
+
+def _jwt_expiry(token: str) -> float | None:
+    """Время истечения (unix time) из claim `exp` JWT без проверки подписи."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = jsonlib.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return float(exp) if exp is not None else None
+    except (IndexError, ValueError, TypeError, AttributeError):
+        return None
 
 
 class MarzbanAPIError(Exception):
@@ -38,6 +76,24 @@ class MarzbanAPIError(Exception):
         super().__init__(f"Marzban API error {status}: {message}")
 
 
+class MarzbanUnavailableError(MarzbanAPIError):
+    """
+    Панель недоступна: ошибка соединения, таймаут, ответ 502/503/504
+    или разомкнутый circuit breaker (запрос не отправлялся).
+    """
+
+    def __init__(
+        self,
+        message: str,
+        breaker_state: str,
+        retry_after: float = 0.0,
+        status: int = 503,
+    ):
+        super().__init__(status, message)
+        self.breaker_state = breaker_state
+        self.retry_after = retry_after
+
+
 class MarzbanAPIClient:
     """
     Асинхронный клиент для Marzban API на базе aiohttp.
@@ -54,6 +110,17 @@ class MarzbanAPIClient:
         admin_password: str,
         session: aiohttp.ClientSession | None = None,
         request_timeout: int = 15,
+        user_cache_ttl: float = 0,
+        user_cache_size: int = 10000,
+        api_url: str | None = None,
+        connection_limit: int = 100,
+        keepalive_timeout: float = 60,
+        dns_cache_ttl: int = 300,
+        user_cache_stale_ttl: float = 0,
+        retry_policy: RetryPolicy | None = None,
+        circuit_breaker: CircuitBreaker | None = None,
+        max_concurrency: int = 32,
+        priority_limits: Dict[str, int] | None = None,
     ) -> None:
         """
         :param base_url: Базовый URL панели Marzban, например: "http://127.0.0.1:8000"
@@ -63,14 +130,85 @@ class MarzbanAPIClient:
         :param session: Необязательная внешняя aiohttp‑сессия
                         (если не указана – будет создана внутренняя).
         :param request_timeout: Таймаут HTTP‑запросов, секунд.
+        :param user_cache_ttl: Время жизни UserResponse в кэше get_user, секунд
+                               (0 — кэш отключён).
+        :param user_cache_size: Максимальное количество пользователей в кэше.
+        :param api_url: Адрес для запросов к API, если он отличается от base_url:
+                        "http://127.0.0.1:8000" или "unix:///path/to/panel.socket"
+                        (Unix-сокет на том же хосте, без TCP/TLS). base_url
+                        по-прежнему используется для публичных ссылок.
+        :param connection_limit: Максимум одновременных соединений с панелью.
+        :param keepalive_timeout: Сколько держать простаивающее соединение
+                                  открытым для повторного использования, секунд.
+        :param dns_cache_ttl: Время кэширования DNS-ответов для хоста панели, секунд.
+        :param user_cache_stale_ttl: Сколько секунд после истечения TTL хранить
+                                     пользователя для get_user_or_stale().
+        :param retry_policy: Повторы идемпотентных запросов при недоступности панели
+                             (по умолчанию RetryPolicy()).
+        :param circuit_breaker: Быстрый отказ, пока панель недоступна
+                                (по умолчанию CircuitBreaker()).
+        :param max_concurrency: Максимум одновременных запросов к панели.
+        :param priority_limits: Потолок одновременных запросов для классов из
+                                REQUEST_PRIORITIES (по умолчанию max_concurrency).
+
+        Параметры соединений применяются только к сессии, созданной клиентом.
         """
         self._base_url = base_url.rstrip("/")
+        self._uds_path: str | None = None
+        api_url = (api_url or base_url).rstrip("/")
+        if api_url.startswith("unix://"):
+            self._uds_path = api_url[len("unix://") :]
+            # Хост нужен только для заголовка Host — соединение идёт через сокет
+            self._api_url = "http://localhost"
+        else:
+            self._api_url = api_url
         self._admin_username = admin_username
         self._admin_password = admin_password
         self._external_session = session
         self._session: aiohttp.ClientSession | None = session
         self._timeout = aiohttp.ClientTimeout(total=request_timeout)
+        self._connection_limit = connection_limit
+        self._keepalive_timeout = keepalive_timeout
+        self._dns_cache_ttl = dns_cache_ttl
+        # Счётчики пула соединений сессии (заполняются через TraceConfig)
+        self._connections_created = 0
+        self._connections_reused = 0
+        self._connections_queued = 0
+        self._requests_in_flight = 0
+        self._requests_in_flight_peak = 0
+        self._connect_time = LatencyHistogram()
+        self._connection_queue_wait = LatencyHistogram()
+        # Идущие сейчас GET-запросы: одинаковые запросы ждут один ответ
+        self._inflight_gets: Dict[tuple, asyncio.Future] = {}
+        self._gets_coalesced = 0
+
+        self._retry_policy = retry_policy or RetryPolicy()
+        self._breaker = circuit_breaker or CircuitBreaker()
+        self._limiter = PriorityLimiter(
+            max_concurrency, REQUEST_PRIORITIES, priority_limits
+        )
+
         self._access_token: str | None = None
+        self._token_expires_at: float | None = None
+        # Одновременно идёт не больше одного логина в панели
+        self._auth_lock = asyncio.Lock()
+
+        # Кэш get_user: username -> (время получения, UserResponse).
+        # create/modify/delete_user пишут в него сразу (write-through).
+        self._user_cache = (
+            TTLCache(
+                maxsize=user_cache_size,
+                ttl=user_cache_ttl,
+                stale_ttl=user_cache_stale_ttl,
+            )
+            if user_cache_ttl > 0
+            else None
+        )
+        self._user_cache_age_total = 0.0
+        self._user_cache_age_max = 0.0
+        # username -> номер записи: ответ GET, начатого до записи в
+        # пользователя, не должен перезаписать в кэше более новые данные
+        self._user_generation: Dict[str, int] = {}
 
     # ------------------------------------------------------------------
     # Вспомогательные методы
@@ -81,16 +219,205 @@ class MarzbanAPIClient:
         """Текущий токен администратора (может быть None, если ещё не авторизовались)."""
         return self._access_token
 
+    def _cache_user(self, user: UserResponse, generation: int | None = None) -> None:
+        """
+        Сохранить свежий ответ панели по пользователю в кэш.
+
+        :param generation: Номер записи (_user_generation) на момент начала
+                           GET; если с тех пор пользователя меняли, ответ
+                           мог устареть и в кэш не попадает.
+        """
+        if self._user_cache is None:
+            return
+        if (
+            generation is not None
+            and self._user_generation.get(user.username, 0) != generation
+        ):
+            return
+        self._user_cache.set(user.username, (time.monotonic(), user))
+
+    def _user_written(self, username: str) -> None:
+        """
+        Пользователь изменён: начатые до этого GET не попадут в кэш, а новые
+        вызовы get_user не присоединятся к ним и пойдут в панель заново.
+        """
+        path = f"/api/user/{username}"
+        for key in [key for key in self._inflight_gets if key[0] == path]:
+            del self._inflight_gets[key]
+        if self._user_cache is not None:
+            self._user_generation[username] = self._user_generation.get(username, 0) + 1
+
+    def invalidate_user(self, username: str) -> None:
+        """Сбросить закэшированного пользователя (изменён в обход клиента)."""
+        self._user_written(username)
+        if self._user_cache is not None:
+            self._user_cache.pop(username)
+
+    def user_cache_stats(self) -> Dict[str, Any]:
+        """Счётчики кэша get_user и возраст отданных из кэша ответов, секунд."""
+        if self._user_cache is None:
+            return {"enabled": False}
+        stats = self._user_cache.stats()
+        return {
+            "enabled": True,
+            **stats,
+            "avg_age_on_hit": (
+                self._user_cache_age_total / stats["hits"] if stats["hits"] else 0.0
+            ),
+            "max_age_on_hit": self._user_cache_age_max,
+        }
+
+    def connection_stats(self) -> Dict[str, Any]:
+        """Использование пула соединений с панелью."""
+        opened = self._connections_created + self._connections_reused
+        return {
+            "transport": "unix" if self._uds_path else "tcp",
+            "limit": self._connection_limit,
+            "keepalive_timeout": self._keepalive_timeout,
+            "in_flight": self._requests_in_flight,
+            "in_flight_peak": self._requests_in_flight_peak,
+            "created": self._connections_created,
+            "reused": self._connections_reused,
+            "reuse_ratio": self._connections_reused / opened if opened else 0.0,
+            "queued": self._connections_queued,
+            "gets_in_flight": len(self._inflight_gets),
+            "gets_coalesced": self._gets_coalesced,
+            "connect_ms": self._connect_time.snapshot(),
+            "queue_wait_ms": self._connection_queue_wait.snapshot(),
+        }
+
+    @property
+    def breaker_state(self) -> str:
+        """Состояние circuit breaker панели: closed, open или half_open."""
+        return self._breaker.state
+
+    @property
+    def is_available(self) -> bool:
+        """False, пока breaker разомкнут и запросы к панели отклоняются сразу."""
+        return self._breaker.state != CircuitBreaker.OPEN
+
+    def stats(self) -> Dict[str, Any]:
+        """Метрики клиента для мониторинга."""
+        return {
+            "breaker": self._breaker.stats(),
+            "retry": self._retry_policy.stats(),
+            "limiter": self._limiter.stats(),
+            "connections": self.connection_stats(),
+            "user_cache": self.user_cache_stats(),
+        }
+
+    @contextmanager
+    def priority(self, name: str):
+        """
+        Класс запросов к панели внутри блока:
+
+            with marzban_client.priority("webhook"):
+                await marzban_client.modify_user(...)
+        """
+        if name not in REQUEST_PRIORITIES:
+            raise ValueError(f"Неизвестный класс запросов: {name}")
+        token = _request_priority.set(name)
+        try:
+            yield
+        finally:
+            _request_priority.reset(token)
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        """Хуки aiohttp для счётчиков пула соединений."""
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            self._requests_in_flight += 1
+            self._requests_in_flight_peak = max(
+                self._requests_in_flight_peak, self._requests_in_flight
+            )
+
+        async def on_request_done(session, ctx, params):
+            self._requests_in_flight -= 1
+
+        async def on_connection_create_start(session, ctx, params):
+            ctx.connect_started = time.perf_counter()
+
+        async def on_connection_create_end(session, ctx, params):
+            self._connections_created += 1
+            self._connect_time.observe(
+                (time.perf_counter() - ctx.connect_started) * 1000
+            )
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self._connections_reused += 1
+
+        async def on_connection_queued_start(session, ctx, params):
+            ctx.queued_started = time.perf_counter()
+
+        async def on_connection_queued_end(session, ctx, params):
+            self._connections_queued += 1
+            self._connection_queue_wait.observe(
+                (time.perf_counter() - ctx.queued_started) * 1000
+            )
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_done)
+        trace_config.on_request_exception.append(on_request_done)
+        trace_config.on_connection_create_start.append(on_connection_create_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_connection_queued_start.append(on_connection_queued_start)
+        trace_config.on_connection_queued_end.append(on_connection_queued_end)
+        return trace_config
+
+    def _create_connector(self) -> aiohttp.BaseConnector:
+        """Коннектор с лимитами и keep-alive (TCP_NODELAY aiohttp ставит сам)."""
+        if self._uds_path:
+            return aiohttp.UnixConnector(
+                path=self._uds_path,
+                limit=self._connection_limit,
+                keepalive_timeout=self._keepalive_timeout,
+            )
+        return aiohttp.TCPConnector(
+            limit=self._connection_limit,
+            limit_per_host=self._connection_limit,
+            keepalive_timeout=self._keepalive_timeout,
+            ttl_dns_cache=self._dns_cache_ttl,
+        )
+
     async def _get_session(self) -> aiohttp.ClientSession:
         """Ленивая инициализация aiohttp‑сессии."""
         if self._session is None:
-            self._session = aiohttp.ClientSession(timeout=self._timeout)
+            self._session = aiohttp.ClientSession(
+                timeout=self._timeout,
+                connector=self._create_connector(),
+                trace_configs=[self._trace_config()],
+            )
             
             # Временно отключаем проверку SSL для обхода проблем с сертификатами
             # connector = aiohttp.TCPConnector(verify_ssl=False)
             # self._session = aiohttp.ClientSession(timeout=self._timeout, connector=connector)
         return self._session
 
+    async def warm_up(self, connections: int, timeout: float = 10) -> None:
+        """
+        Заранее авторизоваться и открыть до `connections` keep-alive соединений,
+        чтобы первые запросы пользователей не платили за TCP/TLS и логин.
+        Ошибки только логируются: недоступность панели не мешает запуску бота.
+        """
+        if connections <= 0:
+            return
+        try:
+            # Параллельные запросы занимают разные соединения,
+            # после ответа они остаются в пуле
+            await asyncio.wait_for(
+                asyncio.gather(
+                    *(
+                        self._request("GET", "/api/admin", coalesce=False)
+                        for _ in range(connections)
+                    )
+                ),
+                timeout,
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось прогреть соединения с панелью: {e!r}")
+
     async def close(self) -> None:
         """Закрыть внутреннюю HTTP‑сессию (если она была создана клиентом)."""
         if self._session is not None and self._session is not self._external_session:
@@ -133,24 +460,165 @@ class MarzbanAPIClient:
         json: Any | None = None,
         data: Any | None = None,
         need_auth: bool = True,
+        parse: Callable[[Any], Any] | None = None,
+        coalesce: bool = True,
+        priority: str | None = None,
+        weight: int = 1,
     ) -> Any:
         """
         Унифицированный метод отправки HTTP‑запроса с автоматической повторной аутентификацией при 401 ошибке.
 
+        Одинаковые (путь, параметры, parse) GET-запросы, идущие одновременно,
+        объединяются: в панель уходит один запрос, все вызывающие получают
+        один и тот же результат (или исключение).
+
         :param method: HTTP‑метод (GET, POST, PUT, DELETE ...).
         :param path: Путь внутри API, например "/api/admin".
         :param params: Параметры query‑строки.
         :param json: JSON‑тело запроса.
         :param data: Форм‑данные (используется для /api/admin/token).
         :param need_auth: Требуется ли заголовок Authorization.
+        :param parse: Преобразование ответа (например, Model.model_validate),
+                      выполняется один раз на объединённый запрос.
+        :param coalesce: Объединять ли GET с уже идущим таким же запросом
+                         (False — нужен ответ, полученный после вызова).
+        :param priority: Класс запроса из REQUEST_PRIORITIES (по умолчанию —
+                         заданный через priority(), иначе "interactive").
+                         Объединённый GET идёт с классом первого вызвавшего.
+        :param weight: Сколько слотов лимитера занимает запрос (тяжёлые выборки).
         """
+        send_args = (
+            method,
+            path,
+            params,
+            json,
+            data,
+            need_auth,
+            parse,
+            priority or _request_priority.get(),
+            weight,
+        )
+        if method != "GET" or not coalesce:
+            return await self._send(*send_args)
+
+        key = (path, self._params_key(params), need_auth, parse)
+        task = self._inflight_gets.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._send(*send_args))
+            self._inflight_gets[key] = task
+            task.add_done_callback(functools.partial(self._forget_inflight_get, key))
+        else:
+            self._gets_coalesced += 1
+        # Отмена одного из ожидающих не должна отменять запрос для остальных
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def _params_key(params: Dict[str, Any] | None) -> tuple:
+        if not params:
+            return ()
+        return tuple(
+            sorted(
+                (name, tuple(value) if isinstance(value, list) else value)
+                for name, value in params.items()
+            )
+        )
+
+    def _forget_inflight_get(self, key: tuple, task: asyncio.Future) -> None:
+        if self._inflight_gets.get(key) is task:
+            del self._inflight_gets[key]
+        # Помечаем исключение полученным, даже если все ожидающие отменены
+        if not task.cancelled():
+            task.exception()
+
+    async def _send(
+        self,
+        method: str,
+        path: str,
+        params: Dict[str, Any] | None,
+        json: Any | None,
+        data: Any | None,
+        need_auth: bool,
+        parse: Callable[[Any], Any] | None,
+        priority: str,
+        weight: int,
+    ) -> Any:
+        """
+        Отправка запроса без объединения (см. _request) через circuit breaker
+        и лимитер одновременных запросов (слот занят только на время попытки).
+        Идемпотентные запросы повторяются при недоступности панели по retry_policy.
+        Ошибки соединения и таймауты превращаются в MarzbanUnavailableError.
+        """
+        self._retry_policy.on_request()
+        attempt = 0
+        while True:
+            if not self._breaker.allow_request():
+                raise MarzbanUnavailableError(
+                    "circuit breaker open",
+                    breaker_state=self._breaker.state,
+                    retry_after=self._breaker.retry_after,
+                )
+            try:
+                async with self._limiter.slot(priority, weight):
+                    result = await self._send_once(
+                        method, path, params, json, data, need_auth
+                    )
+            except (aiohttp.ClientError, asyncio.TimeoutError, MarzbanAPIError) as e:
+                panel_failed = (
+                    not isinstance(e, MarzbanAPIError)
+                    or e.status in UNAVAILABLE_STATUSES
+                )
+                if not panel_failed:
+                    # Панель ответила — с ней всё в порядке
+                    self._breaker.record_success()
+                    raise
+                self._breaker.record_failure()
+                if (
+                    method in IDEMPOTENT_METHODS
+                    and self._breaker.state == CircuitBreaker.CLOSED
+                    and self._retry_policy.try_acquire_retry(attempt)
+                ):
+                    await asyncio.sleep(self._retry_policy.backoff(attempt))
+                    attempt += 1
+                    continue
+                if isinstance(e, MarzbanUnavailableError):
+                    raise
+                if isinstance(e, MarzbanAPIError):
+                    raise MarzbanUnavailableError(
+                        e.message, breaker_state=self._breaker.state, status=e.status
+                    ) from e
+                raise MarzbanUnavailableError(
+                    f"{method} {path}: {e!r}", breaker_state=self._breaker.state
+                ) from e
+            except Exception:
+                # Неожиданная ошибка (не-JSON ответ прокси, неверный ответ
+                # логина) — тоже сбой, иначе пробный запрос в half_open
+                # не завершится и автомат останется разомкнутым навсегда
+                self._breaker.record_failure()
+                raise
+            except BaseException:
+                # Отмена — запрос прерван без результата
+                self._breaker.release()
+                raise
+            self._breaker.record_success()
+            return parse(result) if parse is not None else result
+
+    async def _send_once(
+        self,
+        method: str,
+        path: str,
+        params: Dict[str, Any] | None,
+        json: Any | None,
+        data: Any | None,
+        need_auth: bool,
+    ) -> Any:
+        """Одна попытка запроса с повторной аутентификацией при 401."""
         session = await self._get_session()
 
-        # Автоматическая аутентификация: если необходимо
-        if need_auth and not self._access_token:
-            await self._authenticate()
+        # Автоматическая аутентификация: нет токена или он скоро истечёт
+        if need_auth and (not self._access_token or self._token_expiring()):
+            await self._authenticate(stale_token=self._access_token)
 
-        url = f"{self._base_url}{path}"
+        url = f"{self._api_url}{path}"
         headers: Dict[str, str] = {}
         if need_auth:
             headers.update(self._auth_headers())
@@ -172,37 +640,65 @@ class MarzbanAPIClient:
                 return text
 
         try:
-            return await _make_request()
+            result = await _make_request()
         except MarzbanAPIError as e:
             # Если получен код 401 и требуется авторизация, выполняем повторную аутентификацию
             if e.status == 401 and need_auth:
-                await self._authenticate()
+                await self._authenticate(stale_token=headers.get("Authorization"))
                 headers.update(self._auth_headers())
-                return await _make_request()
+                result = await _make_request()
             else:
                 raise
+        return result
 
     # ------------------------------------------------------------------
     # Аутентификация администратора
     # ------------------------------------------------------------------
 
-    async def _authenticate(self) -> None:
-            """Выполнить аутентификацию администратора и сохранить токен."""
+    def _token_expiring(self) -> bool:
+        """Токен истекает в ближайшие TOKEN_REFRESH_MARGIN секунд."""
+        return (
+            self._token_expires_at is not None
+            and time.time() >= self._token_expires_at - TOKEN_REFRESH_MARGIN
+        )
+
+    async def _authenticate(self, stale_token: str | None = None) -> None:
+        """
+        Выполнить аутентификацию администратора и сохранить токен.
+
+        Логин single-flight: конкурирующие вызовы ждут первый и не логинятся
+        повторно, если токен уже сменился со stale_token (устаревшего токена,
+        с которым они работали; допускается и "Bearer <token>").
+
+        :param stale_token: Токен, который вызывающий считает устаревшим.
+        """
+        if stale_token and stale_token.startswith("Bearer "):
+            stale_token = stale_token[len("Bearer ") :]
+
+        async with self._auth_lock:
+            if (
+                self._access_token
+                and self._access_token != stale_token
+                and not self._token_expiring()
+            ):
+                return
+
             form_data: Dict[str, str] = {
                 "grant_type": "password",
                 "username": self._admin_username,
                 "password": self._admin_password,
             }
-            
+
             session = await self._get_session()
             async with session.post(
-                f"{self._base_url}/api/admin/token",
+                f"{self._api_url}/api/admin/token",
                 data=form_data,
             ) as resp_token:
                 await self._raise_for_status(resp_token)
                 data_token = await resp_token.json()
                 token = Token.model_validate(data_token)
                 self._access_token = token.access_token
+                self._token_expires_at = _jwt_expiry(token.access_token)
 
     # ------------------------------------------------------------------
     # Admin API
@@ -263,33 +759,105 @@ class MarzbanAPIClient:
     # Users API
     # ------------------------------------------------------------------
 
-    async def create_user(self, user: UserCreate) -> UserResponse:
-        """POST /api/user — создать пользователя."""
+    async def create_user(
+        self, user: UserCreate, *, optimistic: bool = False
+    ) -> UserResponse:
+        """
+        POST /api/user — создать пользователя (или вернуть существующего).
+
+        :param optimistic: Сразу отправить POST без предварительного GET
+                           (вызывающий уже получил 404). Если пользователь
+                           всё-таки существует (409), он запрашивается из панели.
+        """
+        if optimistic:
+            try:
+                return await self._post_user(user)
+            except MarzbanAPIError as e:
+                if e.status == 409:
+                    return await self.get_user(user.username, fresh=True)
+                raise
+
         # Проверяем, существует ли пользователь уже
         try:
-            existing_user = await self.get_user(user.username)
+            existing_user = await self.get_user(user.username, fresh=True)
             return existing_user
         except MarzbanAPIError as e:
             if e.status == 404:
-                payload = user.model_dump(exclude_none=True, mode="json")
-                data = await self._request("POST", "/api/user", json=payload)
-                return UserResponse.model_validate(data)
+                return await self._post_user(user)
             raise
 
-    async def get_user(self, username: str) -> UserResponse:
-        """GET /api/user/{username} — получить пользователя по username."""
-        data = await self._request("GET", f"/api/user/{username}")
-        return UserResponse.model_validate(data)
+    async def _post_user(self, user: UserCreate) -> UserResponse:
+        payload = user.model_dump(exclude_none=True, mode="json")
+        data = await self._request("POST", "/api/user", json=payload)
+        created_user = UserResponse.model_validate(data)
+        self._user_written(created_user.username)
+        self._cache_user(created_user)
+        return created_user
+
+    async def get_user(self, username: str, *, fresh: bool = False) -> UserResponse:
+        """
+        GET /api/user/{username} — получить пользователя по username.
+
+        :param fresh: Запросить панель в обход кэша (для сценариев, которые
+                      изменяют пользователя на основе прочитанных данных).
+        """
+        if self._user_cache is not None and not fresh:
+            cached = self._user_cache.get(username)
+            if cached is not None:
+                stored_at, cached_user = cached
+                age = time.monotonic() - stored_at
+                self._user_cache_age_total += age
+                self._user_cache_age_max = max(self._user_cache_age_max, age)
+                return cached_user
+
+        generation = self._user_generation.get(username, 0)
+        user = await self._request(
+            "GET",
+            f"/api/user/{username}",
+            parse=UserResponse.model_validate,
+            coalesce=not fresh,
+        )
+        self._cache_user(user, generation)
+        return user
+
+    async def get_user_or_stale(self, username: str) -> tuple[UserResponse, bool]:
+        """
+        То же, что get_user, но если панель недоступна — вернуть последнюю
+        известную копию из кэша (в пределах user_cache_stale_ttl).
+
+        :return: (пользователь, True если копия устаревшая).
+        :raises MarzbanUnavailableError: панель недоступна и копии нет.
+        """
+        try:
+            return await self.get_user(username), False
+        except MarzbanUnavailableError:
+            if self._user_cache is None:
+                raise
+            cached = self._user_cache.get_stale(username)
+            if cached is None:
+                raise
+            return cached[1], True
 
     async def modify_user(self, username: str, update: UserModify) -> UserResponse:
         """PUT /api/user/{username} — изменить пользователя."""
         payload = update.model_dump(exclude_none=True, mode="json")
-        data = await self._request("PUT", f"/api/user/{username}", json=payload)
-        return UserResponse.model_validate(data)
+        try:
+            data = await self._request("PUT", f"/api/user/{username}", json=payload)
+        except MarzbanAPIError:
+            # Состояние в панели неизвестно — не отдаём старую копию
+            self.invalidate_user(username)
+            raise
+        modified_user = UserResponse.model_validate(data)
+        self._user_written(username)
+        self._cache_user(modified_user)
+        return modified_user
 
     async def delete_user(self, username: str) -> str:
         """DELETE /api/user/{username} — удалить пользователя."""
-        data = await self._request("DELETE", f"/api/user/{username}")
+        try:
+            data = await self._request("DELETE", f"/api/user/{username}")
+        finally:
+            self.invalidate_user(username)
         return str(data)
 
     async def list_users(
@@ -299,11 +867,14 @@ class MarzbanAPIClient:
         limit: int | None = None,
         username: str | None = None,
         status: str | None = None,
+        priority: str | None = None,
     ) -> UsersResponse:
         """
         GET /api/users — получить список пользователей.
 
         Тело ответа согласно Swagger маппится на модель UsersResponse.
+
+        :param priority: Класс запроса для лимитера (см. REQUEST_PRIORITIES).
         """
         params: Dict[str, Any] = {}
         if offset is not None:
@@ -315,8 +886,60 @@ class MarzbanAPIClient:
         if status:
             params["status"] = status
 
-        data = await self._request("GET", "/api/users", params=params)
-        return UsersResponse.model_validate(data)
+        return await self._request(
+            "GET",
+            "/api/users",
+            params=params,
+            parse=UsersResponse.model_validate,
+            priority=priority,
+        )
+
+    async def iter_users(
+        self,
+        *,
+        page_size: int = 500,
+        status: str | None = None,
+        priority: str = "background",
+    ) -> AsyncIterator[UserResponse]:
+        """
+        Обойти всех пользователей панели постранично (GET /api/users).
+
+        Пока вызывающий обрабатывает страницу N, страница N+1 уже загружается;
+        в памяти не больше двух страниц. Пагинация по offset: пользователи,
+        созданные или удалённые во время обхода, могут быть пропущены
+        или встретиться дважды.
+
+            async for user in marzban_client.iter_users(status="active"):
+                ...
+
+        :param page_size: Пользователей на страницу.
+        :param status: Фильтр по статусу (active, expired, ...).
+        :param priority: Класс запросов для лимитера, по умолчанию фоновый.
+        """
+
+        def fetch(offset: int) -> asyncio.Future:
+            return asyncio.ensure_future(
+                self.list_users(
+                    offset=offset, limit=page_size, status=status, priority=priority
+                )
+            )
+
+        offset = 0
+        next_page: asyncio.Future | None = fetch(offset)
+        try:
+            while next_page is not None:
+                page = await next_page
+                offset += len(page.users)
+                has_more = len(page.users) == page_size and offset < page.total
+                next_page = fetch(offset) if has_more else None
+                for user in page.users:
+                    yield user
+        finally:
+            # Обход прерван — следующая страница больше не нужна
+            if next_page is not None:
+                next_page.cancel()
+                if next_page.done() and not next_page.cancelled():
+                    next_page.exception()
 
     # ------------------------------------------------------------------
     # User Templates API
@@ -388,8 +1011,14 @@ class MarzbanAPIClient:
         Название маршрута может отличаться в зависимости от версии Marzban,
         но в Swagger 0.8.4 он маппится на модель SystemStats.
         """
-        data = await self._request("GET", "/api/system")
-        return SystemStats.model_validate(data)
+        # Тяжёлый запрос по всей базе панели — не должен вытеснять пользователей
+        return await self._request(
+            "GET",
+            "/api/system",
+            parse=SystemStats.model_validate,
+            priority="background",
+            weight=2,
+        )
 
 
 __all__ = ["MarzbanAPIClient", "MarzbanAPIError"]
\ No newline at end of file
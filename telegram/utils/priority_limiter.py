@@ -0,0 +1,150 @@
+import asyncio
+import itertools
+import time
+from bisect import insort
+from contextlib import asynccontextmanager, suppress
+from typing import Any, Dict, Sequence
+
+from db_metrics import LatencyHistogram
+
+
+class PriorityLimiter:
+    """
+    Взвешенный семафор с приоритетной очередью и лимитами по классам.
+
+    Общая ёмкость делится между классами запросов; у каждого класса свой
+    потолок одновременных единиц. Ожидающие обслуживаются по приоритету
+    класса (первый в priorities — самый важный), внутри класса — по очереди.
+    Запрос, упёршийся в потолок своего класса, не мешает более низким
+    классам занять свободную ёмкость; упёршийся в общую ёмкость — мешает,
+    чтобы фоновые запросы не обгоняли интерактивные.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        priorities: Sequence[str],
+        class_limits: Dict[str, int] | None = None,
+    ) -> None:
+        """
+        :param capacity: Всего единиц одновременно (обычно = запросов).
+        :param priorities: Классы в порядке убывания приоритета.
+        :param class_limits: Потолок единиц для класса (по умолчанию capacity).
+        """
+        self.capacity = capacity
+        self.priorities = tuple(priorities)
+        self._rank = {name: rank for rank, name in enumerate(self.priorities)}
+        class_limits = class_limits or {}
+        self.class_limits = {
+            name: min(class_limits.get(name, capacity), capacity)
+            for name in self.priorities
+        }
+        self._in_use = 0
+        self._class_in_use = dict.fromkeys(self.priorities, 0)
+        self._class_peak = dict.fromkeys(self.priorities, 0)
+        # Отсортированный список (ранг, номер, вес, класс, future)
+        self._waiters: list = []
+        self._seq = itertools.count()
+        self._queue_wait = {name: LatencyHistogram() for name in self.priorities}
+
+    def _fits(self, name: str, weight: int) -> tuple[bool, bool]:
+        """(хватает общей ёмкости, хватает лимита класса)."""
+        return (
+            self._in_use + weight <= self.capacity,
+            self._class_in_use[name] + weight <= self.class_limits[name],
+        )
+
+    def _take(self, name: str, weight: int) -> None:
+        self._in_use += weight
+        self._class_in_use[name] += weight
+        self._class_peak[name] = max(self._class_peak[name], self._class_in_use[name])
+
+    def _wake(self) -> None:
+        """Выдать единицы ожидающим в порядке приоритета."""
+        index = 0
+        while index < len(self._waiters):
+            _rank, _seq, weight, name, future = self._waiters[index]
+            if future.done():
+                # Отменён, пока ждал
+                del self._waiters[index]
+                continue
+            fits_total, fits_class = self._fits(name, weight)
+            if not fits_total:
+                break
+            if fits_class:
+                self._take(name, weight)
+                future.set_result(None)
+                del self._waiters[index]
+                continue
+            index += 1
+
+    def release(self, name: str, weight: int = 1) -> None:
+        self._in_use -= weight
+        self._class_in_use[name] -= weight
+        self._wake()
+
+    async def acquire(self, name: str, weight: int = 1) -> int:
+        """
+        Дождаться weight единиц для класса name.
+
+        :return: Фактический вес (не больше лимита класса) — его же
+                 нужно передать в release().
+        """
+        if name not in self._rank:
+            raise ValueError(f"Неизвестный класс запросов: {name}")
+        weight = max(1, min(weight, self.class_limits[name]))
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (self._rank[name], next(self._seq), weight, name, future)
+        insort(self._waiters, waiter)
+        self._wake()
+        started = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Единицы уже выданы, но забрать их некому
+                self.release(name, weight)
+            else:
+                future.cancel()
+                # Отменённый мог задерживать ожидающих за ним (не хватало
+                # общей ёмкости на его вес) — убираем его и будим очередь
+                with suppress(ValueError):
+                    self._waiters.remove(waiter)
+                self._wake()
+            raise
+        finally:
+            self._queue_wait[name].observe((time.perf_counter() - started) * 1000)
+        return weight
+
+    @asynccontextmanager
+    async def slot(self, name: str, weight: int = 1):
+        """async with limiter.slot("background"): ..."""
+        weight = await self.acquire(name, weight)
+        try:
+            yield
+        finally:
+            self.release(name, weight)
+
+    def stats(self) -> Dict[str, Any]:
+        queued = dict.fromkeys(self.priorities, 0)
+        for _rank, _seq, _weight, name, future in self._waiters:
+            if not future.done():
+                queued[name] += 1
+        return {
+            "capacity": self.capacity,
+            "in_use": self._in_use,
+            "classes": {
+                name: {
+                    "limit": self.class_limits[name],
+                    "in_use": self._class_in_use[name],
+                    "peak": self._class_peak[name],
+                    "queued": queued[name],
+                    "queue_wait_ms": self._queue_wait[name].snapshot(),
+                }
+                for name in self.priorities
+            },
+        }
+
+
+__all__ = ["PriorityLimiter"]
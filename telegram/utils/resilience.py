@@ -0,0 +1,154 @@
+import random
+import time
+from typing import Any, Dict
+
+
+class RetryPolicy:
+    """
+    Повторы идемпотентных запросов: экспоненциальная задержка с полным
+    джиттером и бюджет повторов, чтобы при деградации сервиса повторы
+    не умножали нагрузку на него.
+
+    Бюджет — ведро токенов: каждый исходный запрос добавляет budget_ratio
+    токена (не больше budget_max), каждый повтор тратит один.
+    """
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        base_delay: float = 0.2,
+        max_delay: float = 2.0,
+        budget_ratio: float = 0.2,
+        budget_max: float = 10.0,
+    ) -> None:
+        """
+        :param attempts: Всего попыток на запрос, включая первую (1 — без повторов).
+        :param base_delay: Базовая задержка перед первым повтором, секунд.
+        :param max_delay: Максимальная задержка между попытками, секунд.
+        :param budget_ratio: Доля повторов от числа запросов в установившемся режиме.
+        :param budget_max: Запас повторов для коротких всплесков ошибок.
+        """
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.budget_max = budget_max
+        self._tokens = budget_max
+        self.retries = 0
+        self.budget_exhausted = 0
+
+    def on_request(self) -> None:
+        """Учесть исходный запрос в бюджете."""
+        self._tokens = min(self.budget_max, self._tokens + self.budget_ratio)
+
+    def try_acquire_retry(self, attempt: int) -> bool:
+        """
+        Можно ли повторить запрос после неудачной попытки номер attempt
+        (с нуля). При успехе списывает токен из бюджета.
+        """
+        if attempt + 1 >= self.attempts:
+            return False
+        if self._tokens < 1:
+            self.budget_exhausted += 1
+            return False
+        self._tokens -= 1
+        self.retries += 1
+        return True
+
+    def backoff(self, attempt: int) -> float:
+        """Задержка перед повтором после попытки номер attempt (с нуля), секунд."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "budget_left": round(self._tokens, 2),
+            "budget_exhausted": self.budget_exhausted,
+        }
+
+
+class CircuitBreaker:
+    """
+    Автомат "closed → open → half_open": после failure_threshold ошибок
+    подряд запросы сразу отклоняются reset_timeout секунд, затем один
+    пробный запрос решает, закрыть автомат или снова открыть.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30) -> None:
+        """
+        :param failure_threshold: Ошибок подряд до размыкания (0 — автомат отключён).
+        :param reset_timeout: Сколько секунд отклонять запросы до пробного.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        if (
+            self._state == self.OPEN
+            and time.monotonic() - self._opened_at >= self.reset_timeout
+        ):
+            return self.HALF_OPEN
+        return self._state
+
+    @property
+    def retry_after(self) -> float:
+        """Через сколько секунд будет разрешён пробный запрос."""
+        if self._state != self.OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def allow_request(self) -> bool:
+        """Можно ли отправить запрос сейчас. В half_open пропускает один пробный."""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probe_in_flight:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        self._state = self.CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._state == self.HALF_OPEN or (
+            self.failure_threshold and self._failures >= self.failure_threshold
+        ):
+            if self._state != self.OPEN:
+                self.opened += 1
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def release(self) -> None:
+        """Запрос отменён без результата — освободить слот пробного запроса."""
+        self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "retry_after": round(self.retry_after, 1),
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+__all__ = ["CircuitBreaker", "RetryPolicy"]
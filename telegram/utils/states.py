@@ -11,4 +11,9 @@ class State_Mailing(StatesGroup):
 
 
 class StateCreateDeepLink(StatesGroup):
-    days = State()
\ No newline at end of file
+    days = State()
+
+
+class StateCreateDeepLinksBulk(StatesGroup):
+    days = State()
+    count = State()
\ No newline at end of file
@@ -0,0 +1,106 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+
+class TTLCache:
+    """
+    Ограниченный по размеру in-process кэш с временем жизни записей.
+
+    При переполнении вытесняются самые давно использованные записи (LRU),
+    просроченные записи удаляются лениво при обращении.
+
+    Если задан stale_ttl, просроченная запись ещё stale_ttl секунд доступна
+    через get_stale() — для ответа "из кэша", когда источник недоступен.
+    """
+
+    _MISSING = object()
+
+    def __init__(
+        self, maxsize: int = 10000, ttl: float = 60.0, stale_ttl: float = 0.0
+    ) -> None:
+        """
+        :param maxsize: Максимальное количество записей в кэше.
+        :param ttl: Время жизни записи, секунд.
+        :param stale_ttl: Сколько ещё секунд хранить просроченную запись для get_stale().
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, self._MISSING, count=False) is not self._MISSING
+
+    def get(self, key: Hashable, default: Any = None, *, count: bool = True) -> Any:
+        """
+        Вернуть значение по ключу или default, если записи нет или она просрочена.
+
+        :param count: Учитывать ли обращение в счётчиках попаданий/промахов.
+        """
+        entry = self._data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            now = time.monotonic()
+            if expires_at > now:
+                self._data.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return value
+            if expires_at + self.stale_ttl <= now:
+                del self._data[key]
+
+        if count:
+            self.misses += 1
+        return default
+
+    def get_stale(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Вернуть значение, даже если оно просрочено (но не дольше stale_ttl).
+        В счётчиках попаданий/промахов не учитывается.
+        """
+        entry = self._data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at + self.stale_ttl > time.monotonic():
+                return value
+            del self._data[key]
+        return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Сохранить значение, при переполнении вытеснив самую старую запись."""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable) -> None:
+        """Удалить запись (инвалидация)."""
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики кэша для мониторинга."""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+__all__ = ["TTLCache"]
@@ -1,3 +1,4 @@
+import asyncio
 import hashlib
 import json
 import logging
@@ -20,6 +21,10 @@ from utils.marzban_api import MarzbanAPIError
 
 logger = logging.getLogger(__name__)
 
+# Попытки подтвердить платёж после продления: иначе его подтвердит только
+# повтор вебхука после истечения аренды (PAYMENT_CLAIM_LEASE)
+COMPLETE_PAYMENT_ATTEMPTS = 3
+
 
 class YooKassaPayment(BaseModel):
     """Модель платежа от ЮKassa"""
@@ -76,6 +81,67 @@ def _verify_signature(request: web.Request, secret_key: str | None) -> bool:
     return signature == expected_signature
 
 
+async def _extend_subscription(user_id: int) -> bool:
+    """
+    Продлевает подписку пользователя в Marzban на 30 дней
+    (или создаёт пользователя, если его ещё нет).
+
+    Returns:
+        True если подписка продлена, False при ошибке API Marzban
+    """
+    # Если есть не активированный пробный период, отменяем его
+    user_tg = await db_manage.get_user_by_id(user_id)
+    if user_tg and user_tg.trial == "true":
+        await db_manage.update_user(user_id, trial="false")
+
+    # Если пользователя в marzban нет создаем его
+    try:
+        # Новая дата считается от текущей — читаем панель в обход кэша
+        user_marz: UserResponse = await marzban_client.get_user(
+            str(user_id), fresh=True
+        )
+
+        # Определяем текущую дату истечения
+        if user_marz.expire:
+            # Если expire это timestamp (int), конвертируем в datetime
+            if isinstance(user_marz.expire, int):
+                current_expire = datetime.fromtimestamp(user_marz.expire)
+            else:
+                current_expire = user_marz.expire
+                # Если datetime имеет timezone, конвертируем в naive datetime
+                if current_expire.tzinfo is not None:
+                    current_expire = current_expire.replace(tzinfo=None)
+        else:
+            # Если подписки нет, начинаем с текущей даты
+            current_expire = datetime.now()
+
+        # Добавляем 30 дней к текущей дате истечения
+        new_expire = current_expire + timedelta(days=30)
+
+        modify_user = UserModify(
+            expire=new_expire,
+            proxy_settings=ProxyTable(vless=VlessSettings(flow=XTLSFlows.VISION)),
+            status=UserStatusModify.active,
+        )
+        await marzban_client.modify_user(str(user_id), modify_user)
+    except MarzbanAPIError as e:
+        if e.status == 404:
+            new_user = UserCreate(
+                username=str(user_id),
+                note=f"User {user_id}",
+                status=UserStatusCreate.active,
+                expire=datetime.now() + timedelta(days=30),
+                group_ids=[1],
+                proxy_settings=ProxyTable(vless=VlessSettings(flow=XTLSFlows.VISION)),
+            )
+            await marzban_client.create_user(new_user, optimistic=True)
+        else:
+            logger.error(f"Marzban API error: {e.message}")
+            return False
+
+    return True
+
+
 async def _process_successful_payment(payment: YooKassaPayment, bot: Bot) -> bool:
     """
     Обрабатывает успешный платеж.
@@ -148,70 +214,63 @@ async def _process_successful_payment(payment: YooKassaPayment, bot: Bot) -> boo
             logger.error(f"Invalid amount value: {amount}")
             return False
 
-        # Если есть не активированный пробный период, отменяем его
-        user_tg = await db_manage.get_user_by_id(user_id)
-        if user_tg and user_tg[7] == "true":  # trial field
-            await db_manage.update_user(user_id, trial="false")
-
-        # Если пользователя в marzban нет создаем его
-        try:
-            user_marz: UserResponse = await marzban_client.get_user(str(user_id))
-
-            # Определяем текущую дату истечения
-            if user_marz.expire:
-                # Если expire это timestamp (int), конвертируем в datetime
-                if isinstance(user_marz.expire, int):
-                    current_expire = datetime.fromtimestamp(user_marz.expire)
-                else:
-                    current_expire = user_marz.expire
-                    # Если datetime имеет timezone, конвертируем в naive datetime
-                    if current_expire.tzinfo is not None:
-                        current_expire = current_expire.replace(tzinfo=None)
-            else:
-                # Если подписки нет, начинаем с текущей даты
-                current_expire = datetime.now()
-
-            # Добавляем 30 дней к текущей дате истечения
-            new_expire = current_expire + timedelta(days=30)
-
-            modify_user = UserModify(
-                expire=new_expire,
-                proxy_settings=ProxyTable(vless=VlessSettings(flow=XTLSFlows.VISION)),
-                status=UserStatusModify.active,
-            )
-            modified_user: UserResponse = await marzban_client.modify_user(
-                str(user_id), modify_user
-            )
-        except MarzbanAPIError as e:
-            if e.status == 404:
-                new_user = UserCreate(
-                    username=str(user_id),
-                    note=f"User {user_id}",
-                    status=UserStatusCreate.active,
-                    expire=datetime.now() + timedelta(days=30),
-                    group_ids=[1],
-                    proxy_settings=ProxyTable(
-                        vless=VlessSettings(flow=XTLSFlows.VISION)
-                    ),
-                )
-                created_user: UserResponse = await marzban_client.create_user(new_user)
-            else:
-                logger.error(f"Marzban API error: {e.message}")
-                return False
-
-        # Сохраняем информацию о платеже в базе данных
+        # Идемпотентность: занимаем платёж одним INSERT IGNORE по уникальному
+        # (provider, provider_payment_charge_id). Повтор вебхука от ЮKassa
+        # не продлевает подписку второй раз и не шлёт сообщение.
         # Конвертируем сумму в копейки для хранения
         amount_in_kopecks = int(float(amount) * 100)
 
-        await db_manage.add_payment(
+        claim = await db_manage.claim_payment(
             user_id=user_id,
             amount=amount_in_kopecks,
             currency=currency,
             payload="one_month",
             telegram_payment_charge_id="",  # Не используется для прямых платежей
             provider_payment_charge_id=payment.id,
-            status="completed",
+            provider="yookassa",
         )
+        if claim == "done":
+            logger.info(f"Payment {payment.id} already processed, skipping")
+            return True
+        if claim == "in_progress":
+            # Ответ с ошибкой: ЮKassa повторит вебхук позже
+            logger.info(f"Payment {payment.id} is being processed, retry later")
+            return False
+
+        if claim == "applied":
+            # Прошлая попытка прервалась после начала продления: было ли оно,
+            # неизвестно, а второе продление недопустимо — только подтверждаем
+            logger.error(
+                f"Payment {payment.id} was interrupted after extension started, "
+                f"completing without extending; check user {user_id} manually"
+            )
+        else:
+            await db_manage.mark_payment_applying(payment.id, provider="yookassa")
+            try:
+                # Платёж уже принят — продление важнее фоновых запросов к панели
+                with marzban_client.priority("webhook"):
+                    extended = await _extend_subscription(user_id)
+            except Exception:
+                await db_manage.release_payment(payment.id, provider="yookassa")
+                raise
+
+            if not extended:
+                # Освобождаем платёж, чтобы повтор вебхука обработал его заново
+                await db_manage.release_payment(payment.id, provider="yookassa")
+                return False
+
+        for attempt in range(COMPLETE_PAYMENT_ATTEMPTS):
+            try:
+                await db_manage.complete_payment(payment.id, provider="yookassa")
+                break
+            except Exception as e:
+                if attempt + 1 == COMPLETE_PAYMENT_ATTEMPTS:
+                    logger.error(
+                        f"Subscription extended but payment {payment.id} "
+                        f"not completed: {e}"
+                    )
+                    return False
+                await asyncio.sleep(2**attempt)
 
         # Отправляем уведомление пользователю
         try: